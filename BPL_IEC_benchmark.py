@@ -0,0 +1,241 @@
+# Benchmark of FMU-explore for BPL_IEC_operation
+#          with timing of the commands used in the notebooks and comparison to a saved baseline
+#------------------------------------------------------------------------------------------------------------------
+# 2026-10-17 - Created with scenarios from the notebook BPL_IEC_operation_fmpy.ipynb
+# 2026-10-17 - Added throughput of simu_sweep() with process pool and thread pool for short runs
+#------------------------------------------------------------------------------------------------------------------
+#
+# Usage:
+#   python BPL_IEC_benchmark.py                                    - FMPy version, result to benchmark.json
+#   python BPL_IEC_benchmark.py --explore BPL_IEC_explore.py       - PyFMI version
+#   python BPL_IEC_benchmark.py --baseline benchmark_baseline.json - compare with baseline and return 1
+#                                                                    if any timing is slower than tolerance
+#
+# Timings are wall time in seconds and given as minimum and median over repeats. Plots are made with the
+# matplotlib backend Agg and closed after each command so that no window is shown.
+
+import sys
+import os
+import io
+import re
+import json
+import time
+import types
+import hashlib
+import argparse
+import platform
+import datetime
+import statistics
+import subprocess
+import contextlib
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+#------------------------------------------------------------------------------------------------------------------
+#  Load explore-script as a module in the same way as with run -i in the notebook
+#------------------------------------------------------------------------------------------------------------------
+
+def load_explore(explore):
+   """ Execute the explore-script in a new module and return it, with printout suppressed."""
+   module = types.ModuleType('BPL_IEC_explore_benchmark')
+   module.__file__ = os.path.abspath(explore)
+   sys.modules[module.__name__] = module
+   with open(explore) as f:
+      code = compile(f.read(), explore, 'exec')
+   with contextlib.redirect_stdout(io.StringIO()):
+      exec(code, module.__dict__)
+   return module
+
+def startup_time(explore):
+   """ Return time to execute the explore-script in a fresh Python process."""
+   code = "import time, io, contextlib, matplotlib; matplotlib.use('Agg'); tic = time.perf_counter(); " \
+        + "f = io.StringIO(); ctx = contextlib.redirect_stdout(f); ctx.__enter__(); " \
+        + "exec(compile(open(" + repr(explore) + ").read(), " + repr(explore) + ", 'exec'), {'__name__': 'bench'}); " \
+        + "ctx.__exit__(None, None, None); print(time.perf_counter() - tic)"
+   output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+   return float(output.stdout.strip().splitlines()[-1])
+
+#------------------------------------------------------------------------------------------------------------------
+#  Timing
+#------------------------------------------------------------------------------------------------------------------
+
+results = {}
+
+def timed(name, command, repeat=3):
+   """ Time command() repeat times with printout suppressed and store minimum and median in results."""
+   times = []
+   for k in range(repeat):
+      with contextlib.redirect_stdout(io.StringIO()):
+         tic = time.perf_counter()
+         command()
+         times.append(time.perf_counter() - tic)
+      plt.close('all')
+   results[name] = {'min': min(times), 'median': statistics.median(times), 'n': repeat}
+   print(name.ljust(45), 'min', format(min(times), '10.4f'), 's   median', format(statistics.median(times), '10.4f'), 's')
+
+#------------------------------------------------------------------------------------------------------------------
+#  Scenarios from the notebook
+#------------------------------------------------------------------------------------------------------------------
+
+def operation_setup(m):
+   """ Set parameters of the CV-based operation in the notebook and return column volume V and flow rate VFR."""
+   h = 20.0
+   d = 1.261
+   a = 3.141592653589793*(d/2)**2
+   V = h*a
+   lfr = 48
+   VFR = a*lfr/60
+   m.par(P_in=1.0, A_in=1.0, E_in=0.0)
+   m.par(height=h, diameter=d, Q_av=6.0)
+   m.init(E_start=50)
+   m.par(E_in_desorption_buffer=8.0)
+   m.par(LFR=lfr)
+   m.par(scale_volume=True, start_adsorption=1.0*V, stop_adsorption=1.5*V)
+   m.par(start_desorption=2.5*V, stationary_desorption=5.5*V)
+   m.par(stop_desorption=7.5*V)
+   m.par(start_pooling=3.7*V, stop_pooling=7.0*V)
+   return V, VFR
+
+def run_benchmarks(m, explore, repeat):
+   """ Run all benchmarks on the loaded explore-module m."""
+
+   # Results should be computed and not taken from the result cache
+   if hasattr(m, 'resultCache'): m.resultCache['enabled'] = False
+
+   times = [startup_time(explore) for k in range(repeat)]
+   results['startup'] = {'min': min(times), 'median': statistics.median(times), 'n': repeat}
+   print('startup'.ljust(45), 'min', format(min(times), '10.4f'), 's   median',
+         format(statistics.median(times), '10.4f'), 's')
+
+   V, VFR = operation_setup(m)
+   simulationTime = (1.0+0.5+1.0+3.0+2.5)*V/VFR
+
+   def operation():
+      m.newplot(title='Operation', plotType='Elution-conductivity-vs-CV-combined-all')
+      m.simu(simulationTime)
+   timed('simu operation init', operation, repeat)
+
+   def operation_cont():
+      m.newplot(title='Operation', plotType='Elution-conductivity-vs-CV-combined-all')
+      m.simu(simulationTime/2)
+      m.simu(simulationTime/2, 'cont')
+   timed('simu operation init and cont', operation_cont, repeat)
+
+   def gradient_series():
+      m.newplot(title='Gradient slope', plotType='Elution-conductivity-vs-CV-combined-all')
+      for fraction in [1.0, 0.5, 0.25]:
+         m.par(stationary_desorption=(2.5 + fraction*3.0)*V)
+         m.simu(simulationTime)
+      m.par(stationary_desorption=5.5*V)
+   timed('simu gradient slope series', gradient_series, repeat)
+
+   def E_in_series():
+      m.newplot(title='E_in', plotType='Elution-conductivity-vs-CV-combined-all')
+      for value in [0, 10, 20]:
+         m.par(E_in=value)
+         m.simu(simulationTime)
+      m.par(E_in=0)
+   timed('simu E_in series', E_in_series, repeat)
+
+   def loading():
+      m.newplot(title='Loading', plotType='Loading')
+      m.simu(simulationTime)
+   timed('simu Loading plot', loading, repeat)
+
+   # Commands that use the result of the last simulation
+   operation()
+   if hasattr(m, 'model_get'):
+      timed('model_get x 1000', lambda: [m.model_get('tank_harvest.m[1]') for k in range(1000)], repeat)
+   timed('disp()', lambda: m.disp(), repeat)
+   timed("describe('parts')", lambda: m.describe('parts'), repeat)
+
+   # Each plot type with its simulation
+   with open(explore) as f:
+      plotTypes = sorted(set(re.findall(r"plotType == '([^']+)'", f.read())))
+   # Plot types that fail, e.g. diagrams with variables not in this model, are recorded with the error
+   for plotType in plotTypes:
+      def plot():
+         m.newplot(title=plotType, plotType=plotType)
+         m.simu(simulationTime)
+      try:
+         timed('newplot ' + plotType, plot, 1)
+      except Exception as error:
+         plt.close('all')
+         results['newplot ' + plotType] = {'error': repr(error)}
+         print(('newplot ' + plotType).ljust(45), 'failed', repr(error))
+
+   # Throughput of parameter sweeps with short runs, in a process pool and in a thread pool
+   if hasattr(m, 'fmuPool'):
+      sweep_throughput(m, simulationTime, repeat)
+
+def sweep_throughput(m, simulationTime, repeat, workers=None, runs=16):
+   """ Time simu_sweep() of short runs with pool='process' and pool='thread' and store scenarios per second.
+       At least 2 workers are used, also on a machine with one CPU, since simu_sweep() runs the scenarios one
+       by one with one worker and the pools would not be compared. Workers and runs are stored with the result.
+       The time of the process pool includes the start of the worker processes, as in use."""
+   if workers is None: workers = max(2, min(os.cpu_count(), 4))
+   scenarios = [{'E_in': 20.0*k/runs} for k in range(runs)]
+   for pool in ['process', 'thread']:
+      name = 'simu_sweep short runs ' + pool + ' pool'
+      timed(name, lambda: m.simu_sweep(scenarios, simulationTime/10, workers=workers, pool=pool), repeat)
+      results[name].update({'throughput': runs/results[name]['min'], 'workers': workers, 'runs': runs})
+      print(''.ljust(45), 'throughput', format(results[name]['throughput'], '10.1f'), 'scenarios/s')
+
+#------------------------------------------------------------------------------------------------------------------
+#  Comparison with baseline
+#------------------------------------------------------------------------------------------------------------------
+
+def compare(baseline_file, tolerance):
+   """ Print the ratio of present and baseline minimum time and return the list of regressions."""
+   with open(baseline_file) as f:
+      baseline = json.load(f)['results']
+   regressions = []
+   print()
+   print('Comparison with baseline', baseline_file, '- minimum time ratio present/baseline')
+   for name in results.keys():
+      if ('min' in results[name]) and ('min' in baseline.get(name, {})) and (baseline[name]['min'] > 0):
+         ratio = results[name]['min']/baseline[name]['min']
+         flag = ''
+         if ratio > 1 + tolerance:
+            flag = 'REGRESSION'
+            regressions.append(name)
+         print(name.ljust(45), format(ratio, '8.2f'), flag)
+   return regressions
+
+def fmu_sha256(fmu_model):
+   with open(fmu_model, 'rb') as f:
+      return hashlib.sha256(f.read()).hexdigest()
+
+#------------------------------------------------------------------------------------------------------------------
+#  Main
+#------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Benchmark of FMU-explore for BPL_IEC_operation')
+   parser.add_argument('--explore', default='BPL_IEC_fmpy_explore.py', help='explore-script to benchmark')
+   parser.add_argument('--output', default='benchmark.json', help='file for the result')
+   parser.add_argument('--baseline', default=None, help='result file from earlier run to compare with')
+   parser.add_argument('--repeat', type=int, default=3, help='number of repeats of each timing')
+   parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+   args = parser.parse_args()
+
+   m = load_explore(args.explore)
+   run_benchmarks(m, args.explore, args.repeat)
+
+   meta = {'explore': args.explore,
+           'interaction': getattr(m, 'FMU_explore', ''),
+           'fmu': m.fmu_model,
+           'fmu_sha256': fmu_sha256(m.fmu_model),
+           'BPL': getattr(m, 'BPL_version', ''),
+           'python': platform.python_version(),
+           'platform': platform.platform(),
+           'date': datetime.datetime.now().isoformat(timespec='seconds')}
+   with open(args.output, 'w') as f:
+      json.dump({'meta': meta, 'results': results}, f, indent=1)
+   print()
+   print('Result stored in', args.output)
+
+   if args.baseline is not None:
+      if compare(args.baseline, args.tolerance): sys.exit(1)
@@ -65,6 +65,12 @@
 # 2025-11-19 - FMU-explore 1.0.2 corrected again parLocation() with sheets as argument
 # 2026-03-28 - FMU-explore 1.0.3
 # 2026-04-14 - BPL 2.3.2
+# 2026-10-17 - Introduced simu_stream() that simulate step by step and yield blocks of samples
+# 2026-10-17 - Parameters set with one set_real/set_integer/set_boolean call per type using value references
+# 2026-10-17 - State to start parameter map built once by state_start_parameter() for any number of states
+# 2026-10-17 - Introduced last_timing and timingProfile for phases of simu()
+# 2026-10-17 - Introduced simu(plot=False) and headless mode without figures and import of matplotlib
+# 2026-10-17 - Introduced ResultMat lazy memory-mapped reader of the binary result file and opts_filter()
 #------------------------------------------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------------------------------------------
@@ -75,9 +81,11 @@ import sys
 import platform
 import locale
 import numpy as np 
-import matplotlib.pyplot as plt
-import matplotlib.image as img
 import zipfile  
+import os
+import re
+import time
+import weakref
 
 from pyfmi import load_fmu
 from pyfmi.fmi import FMUException
@@ -85,6 +93,30 @@ from pyfmi.fmi import FMUException
 from itertools import cycle
 from importlib.metadata import version   
 
+# Matplotlib is imported by newplot() and process_diagram() when first needed - plt and img are then globals
+plt = None
+img = None
+
+def matplotlib_import():
+   """ Import matplotlib.pyplot as plt and matplotlib.image as img the first time."""
+   global plt, img
+   if plt is None:
+      import matplotlib.pyplot as plt
+      import matplotlib.image as img
+
+# Headless mode - no figures are made and diagrams not evaluated, and matplotlib is never imported.
+# Set by headless() or at startup by the environment variable FMU_EXPLORE_HEADLESS=1
+plotSetup = {'headless': os.environ.get('FMU_EXPLORE_HEADLESS', '') not in ['', '0']}
+
+def headless(flag=True):
+   """ Set headless mode on or off for the session, e.g. for batch runs on a server."""
+   plotSetup['headless'] = flag
+
+class PlotNull:
+   """ Stand-in for plt and the axes in headless mode that accepts any call and makes no figure."""
+   def __getattr__(self, name): return self
+   def __call__(self, *args, **kwargs): return self
+
 # Set the environment - for Linux a JSON-file in the FMU is read
 if platform.system() == 'Linux': locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
 
@@ -165,6 +197,36 @@ stateValue =  {}
 stateValue = model.get_states_list()
 stateValue.update(timeDiscreteStates)
 
+# Find the start parameter of a state from the model description
+def state_start_parameter(state, modelVariables):
+   """ Return the name of the parameter that give the initial value of a state, or None if not found.
+       For x[i,j] the parameter is x_start[i,j] and for I.y and D.x of PID-controllers the parameter 
+       is I_start or D_start, or xi_start and xd_start, in the enclosing component."""
+   base, index = re.fullmatch(r'(.*?)((?:\[[0-9, ]+\])?)', state).groups()
+   candidates = [base + '_start' + index]
+   parts = base.split('.')
+   if (len(parts) > 2) and (parts[-2] in ['I', 'D']) and (parts[-1] in ['y', 'x']):
+      for n in range(len(parts)-2, 0, -1):
+         prefix = '.'.join(parts[:n]) + '.'
+         candidates = candidates + [prefix + parts[-2] + '_start', prefix + 'x' + parts[-2].lower() + '_start']
+   for candidate in candidates:
+      if candidate in modelVariables: return candidate
+   return None
+
+# Map each state to its start parameter as value references, built once
+modelVariables = model.get_model_variables()
+stateStartKeys = []
+stateStartVrs = []
+for key in stateValue.keys():
+   startParameter = state_start_parameter(key, modelVariables)
+   if startParameter is None:
+      print('Note: no start parameter found for state', key, '- not used in continued simulation')
+   else:
+      stateStartKeys.append(key)
+      stateStartVrs.append(model.get_variable_valueref(startParameter))
+stateVrs = np.array([model.get_variable_valueref(key) for key in stateStartKeys], dtype=np.uint32)
+stateStartVrs = np.array(stateStartVrs, dtype=np.uint32)
+
 # Create dictionaries parValue and parLocation
 parValue = {}
 
@@ -266,6 +328,13 @@ def newplot(title='IEC', plotType='Loading'):
    # Globals
    global ax1, ax2, ax3, ax4, ax5, ax6    
    global ax11, ax12, ax21, ax22
+
+   # In headless mode diagrams are updated as usual, so that opts_filter() gives the variables, but no figure is made
+   if plotSetup['headless']:
+      plt = PlotNull()
+   else:
+      matplotlib_import()
+      plt = globals()['plt']
     
    # Reset pens
    setLines()
@@ -1139,23 +1208,235 @@ def setLines(lines=['-','--',':','-.']):
 # Show plots from sim_res, just that
 def show(diagrams=diagrams):
    """Show diagrams chosen by newplot()"""
+   if plotSetup['headless']:
+      print('Headless mode - no diagrams shown')
+      return
    # Plot pen
    linetype = next(linecycler)    
    # Plot diagrams 
    for command in diagrams: eval(command)
 
+# Set values in the model with one call per type - the value references are grouped once for each
+# set of variable names and kept in modelSetPlan. Data types are numbered 0 Real, 1 Integer, 2 Boolean, 
+# 3 String and 4 Enumeration in both FMI 1.0 and 2.0
+modelSetPlan = {}
+
+def model_set_plan(names):
+   """ Return list of (data type, positions in names, value references) for variable names."""
+   if names not in modelSetPlan:
+      groups = {}
+      for position, name in enumerate(names):
+         varType = model.get_variable_data_type(name)
+         if varType not in groups: groups[varType] = ([], [])
+         groups[varType][0].append(position)
+         groups[varType][1].append(model.get_variable_valueref(name))
+      modelSetPlan[names] = [(varType, positions, np.array(vrs, dtype=np.uint32)) 
+                             for varType, (positions, vrs) in groups.items()]
+   return modelSetPlan[names]
+
+def model_set_values(values):
+   """ Set a dictionary of variable names and values in the model with one call per type."""
+   names = tuple(values.keys())
+   valueList = list(values.values())
+   for varType, positions, vrs in model_set_plan(names):
+      typeValues = [valueList[position] for position in positions]
+      if varType == 0:
+         model.set_real(vrs, np.array(typeValues, dtype=float))
+      elif varType in [1, 4]:
+         model.set_integer(vrs, np.array(typeValues, dtype=np.int32))
+      elif varType == 2:
+         model.set_boolean(vrs, np.array(typeValues, dtype=bool))
+      else:
+         for position in positions: model.set(names[position], valueList[position])
+
+# Set parameters and initial values from parValue in the model
+def model_set_parameters(parValue=parValue, parLocation=parLocation):
+   """ Set parameter values in parValue to the model."""
+   model_set_values({parLocation[key]:parValue[key] for key in parValue.keys()})
+
+# Set initial state values from the final state in stateValue
+def model_set_states(stateValue=stateValue):
+   """ Set initial state values in the model from the final state of previous simulation in stateValue
+       with one call using the precomputed map from state to start parameter."""
+   model.set_real(stateStartVrs, np.array([stateValue[key] for key in stateStartKeys], dtype=float))
+
+# Store the final state of the model in stateValue with one call
+def model_get_states(stateValue=stateValue):
+   """ Store final state values of the model in stateValue."""
+   stateValue.update(zip(stateStartKeys, model.get_real(stateVrs)))
+   for key in stateValue.keys():
+      if key not in stateStartKeys: stateValue[key] = model.get(key)[0]
+
+# Lazy reader of the binary result file - the file is memory-mapped and a variable decoded on first access
+class ResultMat:
+   """ Result of a simulation from the binary result file of PyFMI, i.e. Dymola MAT v4 format with the
+       matrices Aclass, name, description, dataInfo, data_1 and data_2. Used as sim_res, e.g. sim_res['time'].
+       Only the header of each matrix is read when opened and each variable is decoded when first used.
+       The next simulation rewrites the same file and release_all() then copies the file of open results to memory."""
+
+   matTypes = {0: 'f8', 1: 'f4', 2: 'i4', 3: 'i2', 4: 'u2', 5: 'u1'}
+   opened = weakref.WeakSet()
+
+   def __init__(self, result_file):
+      self.result_file = result_file
+      self._mmap = np.memmap(result_file, dtype=np.uint8, mode='r')
+      ResultMat.opened.add(self)
+      self._matrices = {}
+      offset = 0
+      while offset + 20 <= len(self._mmap):
+         mopt, mrows, ncols, imagf, namlen = np.frombuffer(self._mmap, dtype='<i4', count=5, offset=offset)
+         matrix = bytes(self._mmap[offset+20:offset+20+namlen]).rstrip(b'\x00').decode()
+         dtype = np.dtype(self.matTypes[(mopt//10) % 10]).newbyteorder('<' if mopt//1000 == 0 else '>')
+         start = offset + 20 + namlen
+         # The last matrix data_2 may have more columns than the header says while the file is written
+         if (matrix == 'data_2') & (mrows > 0):
+            ncols = (len(self._mmap) - start)//(mrows*dtype.itemsize)
+         self._matrices[matrix] = (start, mrows, ncols, dtype)
+         offset = start + mrows*ncols*dtype.itemsize*(2 if imagf else 1)
+      self._transposed = self._text('Aclass', transposed=False)[3].startswith('binTrans')
+      self._names = {name: k for k, name in enumerate(self._text('name'))}
+      self._cache = {}
+
+   def _matrix(self, matrix):
+      """ Return a memory-mapped matrix of the file, with the variables as rows if transposed."""
+      start, mrows, ncols, dtype = self._matrices[matrix]
+      return np.ndarray((mrows, ncols), dtype=dtype, buffer=self._mmap, offset=start, order='F')
+
+   def _text(self, matrix, transposed=None):
+      """ Return the list of strings of a text matrix."""
+      if transposed is None: transposed = self._transposed
+      chars = self._matrix(matrix).astype(np.uint8)
+      if transposed: chars = chars.T
+      return [bytes(row).rstrip(b'\x00 ').decode() for row in chars]
+
+   def keys(self):
+      return list(self._names.keys())
+
+   def __contains__(self, name):
+      return name in self._names
+
+   def __getitem__(self, name):
+      if name not in self._cache:
+         if name not in self._names: raise KeyError(name + ' - not in the result file ' + self.result_file)
+         k = self._names[name]
+         dataInfo = self._matrix('dataInfo')
+         info = dataInfo[:, k] if self._transposed else dataInfo[k, :]
+         data = self._matrix('data_1' if info[0] == 1 else 'data_2')
+         index = abs(int(info[1])) - 1
+         values = data[index, :] if self._transposed else data[:, index]
+         # Parameters and constants in data_1 are given at start and end, and expanded to all times as by PyFMI
+         if info[0] == 1: values = np.full(len(self['time']), values[0])
+         # A negative column index gives a variable with opposite sign, i.e. an alias with minus
+         self._cache[name] = (-1.0 if info[1] < 0 else 1.0)*np.array(values, dtype=float)
+      return self._cache[name]
+
+   def final(self, name):
+      return self[name][-1]
+
+   def release(self):
+      """ Copy the file to memory and close the memory-map, so the result stays valid when the file is rewritten."""
+      if isinstance(self._mmap, np.memmap):
+         data = np.array(self._mmap)
+         try:
+            self._mmap._mmap.close()
+         except (AttributeError, BufferError):
+            pass
+         self._mmap = data
+      ResultMat.opened.discard(self)
+
+   @classmethod
+   def release_all(cls, result_file=None):
+      """ Release all open results, or those of result_file, before the file is written again."""
+      for result in list(cls.opened):
+         if (result_file is None) or (os.path.abspath(result.result_file) == os.path.abspath(result_file)):
+            result.release()
+
+# Result filter profile - options that store only the variables used by the diagrams in the result file
+def filter_escape(name):
+   """ Return name as a filter pattern of PyFMI that match the name only, i.e. with [ and ] escaped for fnmatch."""
+   return ''.join({'[': '[[]', ']': '[]]'}.get(c, c) for c in name)
+
+def diagram_variables(diagrams=diagrams):
+   """ Return the sorted list of filter patterns for variables of sim_res used by the diagrams and by profile()."""
+   names = set(['time'])
+   for command in diagrams:
+      names.update(re.findall(r"sim_res\[\s*'([^']+)'\s*\]", command))
+      names.update(re.findall(r'sim_res\[\s*"([^"]+)"\s*\]', command))
+   patterns = set(filter_escape(name) for name in names)
+   if any('profile(' in command for command in diagrams): patterns.add('column.column_section[[]*[]].c[[]*[]]')
+   return sorted(patterns)
+
+def opts_filter(diagrams=diagrams, options=opts_std):
+   """ Return a copy of options with filter for the variables used by the present diagrams, 
+       e.g. newplot(plotType='Elution') and then simu(600, options=opts_filter())."""
+   options_filter = options.copy()
+   options_filter['filter'] = diagram_variables(diagrams)
+   return options_filter
+
+# Timing of the phases of simu() - last_timing holds the last call and timingProfile accumulates over calls
+#   load        - load of the FMU when not loaded before
+#   instantiate - reset() of the model and setting of parameters and initial state values
+#   integrate   - model.simulate() that in PyFMI include initialization and storing of the result file
+#   result      - reading time from the result
+#   state       - capture of the final state in stateValue
+#   plot        - evaluation and plot of diagrams
+# PyFMI has no hook for logging of each FMI call as FMPy, see fmi_call_logger() there
+timingPhases = ['load', 'instantiate', 'integrate', 'result', 'state', 'plot']
+last_timing = {}
+timingProfile = {'enabled': True, 'simu': 0, 'phases': {}}
+
+def timing_add(phase, tic, toc=None):
+   """ Add time from tic to toc, or now, to the phase in last_timing and in timingProfile and return toc."""
+   if toc is None: toc = time.perf_counter()
+   timings = [last_timing]
+   if timingProfile['enabled']: timings.append(timingProfile['phases'])
+   for timing in timings:
+      if phase not in timing: timing[phase] = {'time': 0.0, 'calls': 0}
+      timing[phase]['time'] = timing[phase]['time'] + toc - tic
+      timing[phase]['calls'] = timing[phase]['calls'] + 1
+   return toc
+
+def timing_info(cumulative=False):
+   """ Print time and calls for each phase of the last simu(), or with cumulative=True of all simu() calls."""
+   if cumulative:
+      timing = timingProfile['phases']
+      print('Profile of', timingProfile['simu'], 'simu() calls')
+   else:
+      timing = last_timing
+      print('Timing of last simu()')
+   total = sum(timing[phase]['time'] for phase in timing.keys())
+   for phase in timingPhases:
+      if phase in timing.keys():
+         print(' -' + phase.ljust(12), format(1000*timing[phase]['time'], '10.1f'), 'ms', \
+               format(100*timing[phase]['time']/max(total, 1e-12), '6.1f'), '%', \
+               ' calls:', timing[phase]['calls'])
+   print(' -' + 'total'.ljust(12), format(1000*total, '10.1f'), 'ms')
+
+def timing_reset():
+   """ Clear last_timing and the cumulative timingProfile."""
+   last_timing.clear()
+   timingProfile['simu'] = 0
+   timingProfile['phases'].clear()
+
 # Simulation
 def simu(simulationTimeLocal=simulationTime, mode='Initial', options=opts_std, \
          diagrams=diagrams,timeDiscreteStates=timeDiscreteStates, stateValue=stateValue, \
-         parValue=parValue, parLocation=parLocation, fmu_model=fmu_model):         
+         parValue=parValue, parLocation=parLocation, fmu_model=fmu_model, plot=True):         
    """Model loaded and given intial values and parameter before,
-      and plot window also setup before."""
+      and plot window also setup before. Time of each phase is kept in last_timing, see timing_info().
+      With plot=False, or in headless mode, diagrams are not evaluated but sim_res is the same.
+      With binary result handling sim_res reads the result file lazily, see ResultMat, and the
+      file can be limited to the variables of the diagrams with options=opts_filter()."""
     
    # Global variables
    global model, prevFinalTime, sim_res, t
    
    # Simulation flag
    simulationDone = False
+
+   # Timing of phases
+   last_timing.clear()
+   timingProfile['simu'] = timingProfile['simu'] + 1
    
    # Transfer of argument to global variable
    simulationTime = simulationTimeLocal 
@@ -1168,18 +1449,29 @@ def simu(simulationTimeLocal=simulationTime, mode='Initial', options=opts_std, \
          value_missing =+1
    if value_missing>0: return
          
+   # The binary result file is read by ResultMat and not loaded by PyFMI
+   if (options['result_handling'] == 'binary') & ('return_result' in options.keys()):
+      options = options.copy()
+      options['return_result'] = False
+
    # Load model
+   tic = time.perf_counter()
    if model is None:
       model = load_fmu(fmu_model) 
+      tic = timing_add('load', tic)
    model.reset()
+
+   # Results still memory-mapped from the result file are copied to memory before the file is written again
+   ResultMat.release_all()
       
    # Run simulation
    if mode in ['Initial', 'initial', 'init']:
       # Set parameters and intial state values:
-      for key in parValue.keys():
-         model.set(parLocation[key],parValue[key])   
+      model_set_parameters(parValue, parLocation)
+      tic = timing_add('instantiate', tic)
       # Simulate
       sim_res = model.simulate(final_time=simulationTime, options=options)  
+      tic = timing_add('integrate', tic)
       simulationDone = True
    elif mode in ['Continued', 'continued', 'cont']:
 
@@ -1188,31 +1480,15 @@ def simu(simulationTimeLocal=simulationTime, mode='Initial', options=opts_std, \
       else:
          
          # Set parameters and intial state values:
-         for key in parValue.keys():
-            model.set(parLocation[key],parValue[key])                
-
-         for key in stateValue.keys():
-            if not key[-1] == ']':
-               if key[-3:] == 'I.y': 
-                  model.set(key[:-10]+'I_start', stateValue[key]) 
-               elif key[-3:] == 'D.x': 
-                  model.set(key[:-10]+'D_start', stateValue[key]) 
-               else:
-                  model.set(key+'_start', stateValue[key])
-            elif key[-3] == '[':
-               model.set(key[:-3]+'_start'+key[-3:], stateValue[key]) 
-            elif key[-4] == '[':
-               model.set(key[:-4]+'_start'+key[-4:], stateValue[key]) 
-            elif key[-5] == '[':
-               model.set(key[:-5]+'_start'+key[-5:], stateValue[key]) 
-            else:
-               print('The state vecotr has more than 1000 states')
-               break
+         model_set_parameters(parValue, parLocation)
+         model_set_states(stateValue)
+         tic = timing_add('instantiate', tic)
 
          # Simulate
          sim_res = model.simulate(start_time=prevFinalTime,
                                  final_time=prevFinalTime + simulationTime,
                                  options=options) 
+         tic = timing_add('integrate', tic)
          simulationDone = True             
    else:
       print("Simulation mode not correct")
@@ -1220,14 +1496,19 @@ def simu(simulationTimeLocal=simulationTime, mode='Initial', options=opts_std, \
    if simulationDone:
     
       # Extract data
+      if options['result_handling'] == 'binary': sim_res = ResultMat(sim_res.result_file)
       t = sim_res['time']
+      tic = timing_add('result', tic)
  
       # Plot diagrams
-      linetype = next(linecycler)    
-      for command in diagrams: eval(command)
+      if plot & (not plotSetup['headless']):
+         linetype = next(linecycler)    
+         for command in diagrams: eval(command)
+         tic = timing_add('plot', tic)
             
       # Store final state values stateValue:
-      for key in list(stateValue.keys()): stateValue[key] = model.get(key)[0]        
+      model_get_states(stateValue)
+      timing_add('state', tic)
 
       # Store time from where simulation will start next time
       prevFinalTime = model.time
@@ -1235,6 +1516,49 @@ def simu(simulationTimeLocal=simulationTime, mode='Initial', options=opts_std, \
    else:
       print('Error: No simulation done')
       
+# Streaming simulation - the model is integrated block by block and each block is yielded when ready
+def simu_stream(simulationTimeLocal=simulationTime, blocks=10, mode='Initial', options=opts_std, \
+                stateValue=stateValue, parValue=parValue, parLocation=parLocation):
+   """ Simulate as simu() but integrate step by step and yield the result in blocks of samples, 
+       e.g. for block in simu_stream(600, blocks=60): print(block['time'][-1], block['tank_harvest.V'][-1])
+       Each block is a result object kept in memory and only one block is kept at a time.
+       No diagrams are plotted and sim_res is not changed, but stateValue and prevFinalTime are updated
+       when the last block is done so that simu(mode='cont') can follow."""   
+   global model, prevFinalTime
+
+   if model is None:
+      model = load_fmu(fmu_model) 
+   model.reset()
+
+   if mode in ['Initial', 'initial', 'init']:
+      start_time = 0
+      model_set_parameters(parValue, parLocation)
+   elif mode in ['Continued', 'continued', 'cont']:
+      if prevFinalTime == 0:
+         print("Error: Simulation is first done with default mode = init'")
+         return
+      start_time = prevFinalTime
+      model_set_parameters(parValue, parLocation)
+      model_set_states(stateValue)
+   else:
+      print("Simulation mode not correct")
+      return
+
+   blockTime = simulationTimeLocal/blocks
+   opts_block = options.copy()
+   opts_block['result_handling'] = 'memory'
+   opts_block['ncp'] = max(int(round(options['ncp']/blocks)), 1)
+   for k in range(blocks):
+      opts_block['initialize'] = (k == 0)
+      block = model.simulate(start_time=start_time + k*blockTime, 
+                             final_time=start_time + (k+1)*blockTime, 
+                             options=opts_block)
+      yield block
+
+   # Store final state values in stateValue and time from where simulation will start next time
+   model_get_states(stateValue)
+   prevFinalTime = model.time
+
 # Describe model parts of the combined system
 def describe_parts(component_list=[]):
    """List all parts of the model""" 
@@ -1317,6 +1641,10 @@ def process_diagram(fmu_model=fmu_model, fmu_process_diagram=fmu_process_diagram
    except KeyError:
        print('No processDiagram.png file in the FMU, but try the file on disk.')
        process_diagram = fmu_process_diagram
+   if plotSetup['headless']:
+      print('Headless mode - no process diagram shown')
+      return
+   matplotlib_import()
    try:
        plt.imshow(img.imread(process_diagram))
        plt.axis('off')
@@ -1331,6 +1659,7 @@ def BPL_info():
    print(' - par()       - change of parameters and initial values')
    print(' - init()      - change initial values only')
    print(' - simu()      - simulate and plot')
+   print(' - simu_stream() - simulate and get the result block by block during the simulation')
    print(' - newplot()   - make a new plot')
    print(' - show()      - show plot from previous simulation')
    print(' - disp()      - display parameters and initial values from the last simulation')
@@ -69,6 +69,28 @@
 # 2025-11-19 - FMU-explore 1.0.2 corrected again parLocation() with sheets as argument
 # 2026-03-28 - FMU-explore 1.0.3
 # 2026-04-14 - BPL 2.3.2
+# 2026-10-17 - Introduced modelIndex built once at load time and used by model_get() and describe()
+# 2026-10-17 - Introduced cached FMU backend with extraction and instance kept between simu() calls
+# 2026-10-17 - Introduced simu_sweep() for parameter sweeps in a process pool and par_check()
+# 2026-10-17 - Introduced resultCache with LRU memory tier and optional disk tier used by fmu_simulate()
+# 2026-10-17 - Introduced result store on disk with one npy-file per signal and run, read memory-mapped
+# 2026-10-17 - Diagrams compiled once with the exact sim_res keys needed and these keys used as output
+# 2026-10-17 - Introduced column_concentration() tensor with sections from the model, used by profile()
+# 2026-10-17 - Introduced simu_stream() that simulate step by step and yield blocks of samples
+# 2026-10-17 - Introduced stop conditions for simu() and simu_sweep() to end simulation early
+# 2026-10-17 - Start values set with one setReal/setInteger/setBoolean call per type using value references
+# 2026-10-17 - State to start parameter map built once by state_start_parameter() for any number of states
+# 2026-10-17 - Introduced pooling_evaluate() for many pooling windows from one simulation and pooling_check()
+# 2026-10-17 - Introduced kpi() for yield, purity, productivity, buffer use, dilution and mass balance of runs
+# 2026-10-17 - Introduced last_timing and timingProfile for phases of simu() and fmi_call_logger() statistics
+# 2026-10-17 - Lazy import of matplotlib and simulation part of FMPy, one model_description, startupTiming
+# 2026-10-17 - Model metadata kept in a sidecar JSON-file keyed by FMU SHA-256 and GUID, XML parsed lazily
+# 2026-10-17 - Introduced simu(plot=False) and headless mode without figures and import of matplotlib
+# 2026-10-17 - Introduced simu_sweep(share_prefix=True) that simulate the part scenarios share only once
+# 2026-10-17 - Introduced simu(schedule=...) with parameter changes at given times or pumped volumes
+# 2026-10-17 - Introduced Session with parameters, states, result and FMU instance of its own, simu() uses default
+# 2026-10-17 - Introduced simu_sweep(pool='thread') with FMU instances from fmuPool in a thread pool
+# 2026-10-17 - Introduced simu_async() and simu_sweep_async() for asyncio with cancellation and timeout
 #------------------------------------------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------------------------------------------
@@ -76,23 +98,84 @@
 #------------------------------------------------------------------------------------------------------------------
 
 # Setup framework
+import time
+startupTic = time.perf_counter()
+
 import sys
 import platform
 import locale
 import numpy as np 
-import matplotlib.pyplot as plt
-import matplotlib.image as img
 import zipfile  
-
-from fmpy import simulate_fmu
-from fmpy import read_model_description
-import fmpy as fmpy
+import os
+import shutil
+import hashlib
+import tempfile
+import atexit
+import json
+import re
+import operator
+import threading
+import weakref
+import queue
+import functools
+
+from collections import deque
+from collections import OrderedDict
+from collections import namedtuple
 
 from itertools import cycle
 from importlib.metadata import version 
 
-# Set the environment - for Linux a JSON-file in the FMU is read
-if platform.system() == 'Linux': locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+# Time of each startup step in s - FMPy and matplotlib are imported when first needed, once also when 
+# sessions in threads need them at the same time, and startupTiming is then written by that thread only.
+# Also asyncio, multiprocessing and concurrent.futures are imported by the functions that use them
+startupTiming = {'import': time.perf_counter() - startupTic}
+startupLock = threading.RLock()
+
+# Matplotlib is imported by newplot() and process_diagram() when first needed - plt and img are then globals
+plt = None
+img = None
+
+# Headless mode - no figures are made and diagrams not evaluated, and matplotlib is never imported.
+# Set by headless() or at startup by the environment variable FMU_EXPLORE_HEADLESS=1
+plotSetup = {'headless': os.environ.get('FMU_EXPLORE_HEADLESS', '') not in ['', '0']}
+
+def headless(flag=True):
+   """ Set headless mode on or off for the session, e.g. for batch runs on a server."""
+   plotSetup['headless'] = flag
+
+class PlotNull:
+   """ Stand-in for plt and the axes in headless mode that accepts any call and makes no figure."""
+   def __getattr__(self, name): return self
+   def __call__(self, *args, **kwargs): return self
+
+def matplotlib_import():
+   """ Import matplotlib.pyplot as plt and matplotlib.image as img the first time."""
+   global plt, img
+   with startupLock:
+      if plt is None:
+         tic = time.perf_counter()
+         import matplotlib.pyplot as plt
+         import matplotlib.image as img
+         startupTiming['matplotlib'] = time.perf_counter() - tic
+
+# The simulation part of FMPy is imported, and the environment set, when the FMU is first extracted or simulated
+simulate_fmu = None
+extract = None
+instantiate_fmu = None
+
+def fmpy_simulation_import():
+   """ Import simulate_fmu, extract and instantiate_fmu from FMPy the first time and set the environment."""
+   global simulate_fmu, extract, instantiate_fmu
+   with startupLock:
+      if simulate_fmu is None:
+         tic = time.perf_counter()
+         from fmpy import simulate_fmu
+         from fmpy import extract
+         from fmpy.simulation import instantiate_fmu
+         # Set the environment - for Linux a JSON-file in the FMU is read
+         if platform.system() == 'Linux': locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
+         startupTiming['fmpy_simulation'] = time.perf_counter() - tic
 
 #------------------------------------------------------------------------------------------------------------------
 #  Setup application FMU
@@ -102,7 +185,6 @@ if platform.system() == 'Linux': locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
 if platform.system() == 'Windows':
    print('Windows - run FMU pre-compiled JModelica 2.14')
    fmu_model ='BPL_IEC_Column_system_operation_windows_jm_cs.fmu'       
-   model_description = read_model_description(fmu_model)  
    flag_vendor = 'JM'
    flag_type = 'CS'
 elif platform.system() == 'Linux': 
@@ -111,18 +193,142 @@ elif platform.system() == 'Linux':
    if flag_vendor in ['','JM','jm']:    
       print('Linux - run FMU pre-compiled JModelica 2.4')
       fmu_model ='BPL_IEC_Column_system_operation_linux_jm_cs.fmu'      
-      model_description = read_model_description(fmu_model) 
    if flag_vendor in ['OM','om']:
       print('Linux - run FMU pre-compiled OpenModelica') 
       if flag_type in ['CS','cs']:         
          fmu_model ='BPL_IEC_Column_system_operation_linux_om_cs.fmu'    
-         model_description = read_model_description(fmu_model) 
       if flag_type in ['ME','me']:         
          fmu_model ='BPL_IEC_Column_system_operation_linux_om_me.fmu' 
-         model_description = read_model_description(fmu_model) 
    else:    
       print('There is no FMU for this platform')
 
+# Private per-user cache directory for extracted FMUs - not the shared tempdir where other users could place
+# files that would then be loaded
+def fmu_cache_dir():
+   """ Return the per-user cache directory, created with mode 0700 the first time.
+       Raise PermissionError if the directory is owned by another user or is open to other users."""
+   if platform.system() == 'Windows':
+      base = os.environ.get('LOCALAPPDATA')
+   else:
+      base = os.environ.get('XDG_CACHE_HOME')
+   if not base: base = os.path.join(os.path.expanduser('~'), '.cache')
+   path = os.path.join(base, 'fmu_explore')
+   os.makedirs(path, mode=0o700, exist_ok=True)
+   if hasattr(os, 'getuid'):
+      info = os.stat(path)
+      if (info.st_uid != os.getuid()) | ((info.st_mode & 0o077) != 0):
+         raise PermissionError(path + ' - should be owned by the user and not be accessible by others')
+   return path
+
+# Model metadata sidecar - what is derived from modelDescription.xml at startup is kept in a compact JSON-file
+# keyed by the SHA-256 of the FMU-file and the GUID, and rebuilt when the FMU-file changes. The model 
+# description itself is parsed only when needed for instantiation of the FMU, see model_description_get()
+modelMetaFormat = 1
+model_description = None
+fmuDigest = {}
+
+def fmu_sha256(fmu_model=fmu_model):
+   """ Return the SHA-256 hex digest of the FMU-file, computed once per session."""
+   if fmu_model not in fmuDigest:
+      with open(fmu_model, 'rb') as f:
+         fmuDigest[fmu_model] = hashlib.sha256(f.read()).hexdigest()
+   return fmuDigest[fmu_model]
+
+def model_description_get(fmu_model=fmu_model):
+   """ Return the model description of the FMU, parsed the first time."""
+   global model_description
+   with startupLock:
+      if model_description is None:
+         tic = time.perf_counter()
+         from fmpy import read_model_description
+         model_description = read_model_description(fmu_model)
+         startupTiming['model_description'] = time.perf_counter() - tic
+   return model_description
+
+def model_meta_file(fmu_model=fmu_model):
+   """ Return the name of the sidecar file of the FMU in the private cache directory, see fmu_cache_dir()."""
+   return os.path.join(fmu_cache_dir(), 'fmu_' + os.path.splitext(os.path.basename(fmu_model))[0] \
+                       + '_' + fmu_sha256(fmu_model)[:16] + '.json')
+
+# Keys of the sidecar and their types, checked before the content is used
+modelMetaSchema = {'format': int, 'sha256': str, 'guid': str, 'fmiVersion': str, 'modelName': str, 
+                   'description': (str, type(None)), 'generationTool': (str, type(None)), 
+                   'generationDateAndTime': (str, type(None)), 'modelExchange': bool, 'variables': list, 
+                   'states': list, 'stateStart': dict, 'components': list}
+
+def model_meta_valid(meta, fmu_model=fmu_model):
+   """ Return True if the sidecar content has the format and schema of modelMetaFormat and the SHA-256 of the
+       present FMU-file, the states are variables of the model, stateStart maps each state to a variable or
+       None, and the components are strings."""
+   if not isinstance(meta, dict): return False
+   for key, types in modelMetaSchema.items():
+      if (key not in meta) or (not isinstance(meta[key], types)): return False
+   if (meta['format'] != modelMetaFormat) or (meta['sha256'] != fmu_sha256(fmu_model)): return False
+   for variable in meta['variables']:
+      if (not isinstance(variable, list)) or (len(variable) != 8): return False
+      if (not isinstance(variable[0], str)) or (not isinstance(variable[1], int)): return False
+      if not all(isinstance(item, (str, type(None))) for item in variable[2:]): return False
+   names = set(variable[0] for variable in meta['variables'])
+   if not all(isinstance(name, str) and (name in names) for name in meta['states']): return False
+   if not set(meta['stateStart'].keys()) == set(meta['states']): return False
+   if not all((value is None) or (isinstance(value, str) and (value in names)) 
+              for value in meta['stateStart'].values()): return False
+   return all(isinstance(component, str) for component in meta['components'])
+
+def model_meta_load(fmu_model=fmu_model):
+   """ Return the model metadata from the sidecar file, or parsed from the model description if the file
+       is missing or made for another FMU. Metadata from the sidecar has modelMeta['stored'] True."""
+   try:
+      with open(model_meta_file(fmu_model)) as f:
+         meta = json.load(f)
+      if model_meta_valid(meta, fmu_model):
+         meta['stored'] = True
+         return meta
+   except (OSError, ValueError):
+      pass
+   md = model_description_get(fmu_model)
+   return {'format': modelMetaFormat,
+           'sha256': fmu_sha256(fmu_model),
+           'guid': md.guid,
+           'fmiVersion': md.fmiVersion,
+           'modelName': md.modelName,
+           'description': md.description,
+           'generationTool': md.generationTool,
+           'generationDateAndTime': md.generationDateAndTime,
+           'modelExchange': md.modelExchange is not None,
+           'variables': [[v.name, v.valueReference, v.type, v.causality, v.variability, v.start, v.unit, 
+                          v.description] for v in md.modelVariables],
+           'states': [v.derivative.name for v in md.modelVariables if v.derivative is not None],
+           'stored': False}
+
+def model_meta_store(meta, fmu_model=fmu_model):
+   """ Write the model metadata to the sidecar file, written to a temporary file first and then renamed."""
+   path = model_meta_file(fmu_model)
+   tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+   try:
+      with open(tmp_path, 'w') as f:
+         json.dump({key: value for key, value in meta.items() if key != 'stored'}, f, separators=(',', ':'))
+      os.replace(tmp_path, path)
+      meta['stored'] = True
+   except OSError:
+      pass
+
+modelMeta = model_meta_load(fmu_model)
+
+# Index of model variables built once at load time - used by model_get() and related functions
+modelIndex = {}
+for name, valueReference, varType, causality, variability, start, unit, description in modelMeta['variables']:
+   if name not in modelIndex:
+      modelIndex[name] = {'valueReference': valueReference,
+                          'type': varType,
+                          'causality': causality,
+                          'variability': variability,
+                          'start': start,
+                          'unit': unit,
+                          'description': description}
+
+startupTiming['model_meta'] = time.perf_counter() - startupTic - sum(startupTiming.values())
+
 # Provide various opts-profiles
 if flag_type in ['CS', 'cs']:
    opts_std = {'NCP': 500}
@@ -133,13 +339,11 @@ else:
 
 # Provide various MSL and BPL versions
 if flag_vendor in ['JM', 'jm']:
-   constants = [v for v in model_description.modelVariables if v.causality == 'local'] 
-   MSL_usage = [x[1] for x in [(constants[k].name, constants[k].start) \
-                     for k in range(len(constants))] if 'MSL.usage' in x[0]][0]   
-   MSL_version = [x[1] for x in [(constants[k].name, constants[k].start) \
-                       for k in range(len(constants))] if 'MSL.version' in x[0]][0]
-   BPL_version = [x[1] for x in [(constants[k].name, constants[k].start) \
-                       for k in range(len(constants))] if 'BPL.version' in x[0]][0] 
+   constants = [(name, modelIndex[name]['start']) for name in modelIndex.keys() \
+                if modelIndex[name]['causality'] == 'local'] 
+   MSL_usage = [x[1] for x in constants if 'MSL.usage' in x[0]][0]   
+   MSL_version = [x[1] for x in constants if 'MSL.version' in x[0]][0]
+   BPL_version = [x[1] for x in constants if 'BPL.version' in x[0]][0] 
 elif flag_vendor in ['OM', 'om']:
    MSL_usage = '4.1.0 - used components: RealInput, RealOutput, CombiTimeTable, Types' 
    MSL_version = '4.1.0'
@@ -166,33 +370,72 @@ fmu_process_diagram ='IBPL_IEC_process_diagram_omnigraffle.png'
    
 # Create stateValue that later will be used to store final state and used for initialization in 'cont':
 stateValue =  {}
-stateValue = {variable.derivative.name:None for variable in model_description.modelVariables \
-                                            if variable.derivative is not None}
+stateValue = {name:None for name in modelMeta['states']}
 stateValue.update(timeDiscreteStates) 
 
+# Find the start parameter of a state from the model description
+def state_start_parameter(state):
+   """ Return the name of the parameter that give the initial value of a state, or None if not found.
+       For x[i,j] the parameter is x_start[i,j] and for I.y and D.x of PID-controllers the parameter 
+       is I_start or D_start, or xi_start and xd_start, in the enclosing component."""
+   base, index = re.fullmatch(r'(.*?)((?:\[[0-9, ]+\])?)', state).groups()
+   candidates = [base + '_start' + index]
+   parts = base.split('.')
+   if (len(parts) > 2) and (parts[-2] in ['I', 'D']) and (parts[-1] in ['y', 'x']):
+      for n in range(len(parts)-2, 0, -1):
+         prefix = '.'.join(parts[:n]) + '.'
+         candidates = candidates + [prefix + parts[-2] + '_start', prefix + 'x' + parts[-2].lower() + '_start']
+   for candidate in candidates:
+      if (candidate in modelIndex) and (modelIndex[candidate]['causality'] == 'parameter'): return candidate
+   return None
+
+# Map each state to its start parameter, by name and by value reference, built once and kept in the sidecar
+if 'stateStart' not in modelMeta.keys():
+   modelMeta['stateStart'] = {key: state_start_parameter(key) for key in modelMeta['states']}
+
 stateValueInitial = {}
 for key in stateValue.keys():
-    if not key[-1] == ']':
-         if key[-3:] == 'I.y':
-            stateValueInitial[key] = key[:-10]+'I_start'
-         elif key[-3:] == 'D.x':
-            stateValueInitial[key] = key[:-10]+'D_start'
-         else:
-            stateValueInitial[key] = key+'_start'
-    elif key[-3] == '[':
-        stateValueInitial[key] = key[:-3]+'_start'+key[-3:]
-    elif key[-4] == '[':
-        stateValueInitial[key] = key[:-4]+'_start'+key[-4:]
-    elif key[-5] == '[':
-        stateValueInitial[key] = key[:-5]+'_start'+key[-5:] 
-    else:
-        print('The state vector has more than 1000 states')
-        break
+   if key in modelMeta['stateStart'].keys():
+      startParameter = modelMeta['stateStart'][key]
+   else:
+      startParameter = state_start_parameter(key)
+   if startParameter is None:
+      print('Note: no start parameter found for state', key, '- not used in continued simulation')
+   else:
+      stateValueInitial[key] = startParameter
 
 stateValueInitialLoc = {}
 for value in stateValueInitial.values():
     stateValueInitialLoc[value] = value
 
+stateStartMap = {modelIndex[key]['valueReference']: modelIndex[value]['valueReference'] 
+                 for key, value in stateValueInitial.items()}
+
+# Components of the model, i.e. the first part of the variable names, kept in the sidecar for describe('parts')
+def model_component(variable_name):
+   """ Return the component of a variable name, or '' for internal variables."""
+   i = 0
+   name = ''
+   finished = False
+   if not variable_name[0] == '_':
+      while not finished:
+         name = name + variable_name[i]
+         if i == len(variable_name)-1:
+             finished = True 
+         elif variable_name[i+1] in ['.', '(']: 
+             finished = True
+         else: 
+             i=i+1
+   if name in ['der', 'temp_1', 'temp_2', 'temp_3', 'temp_4', 'temp_5', 'temp_6', 'temp_7']: name = ''
+   return name
+
+if 'components' not in modelMeta.keys():
+   modelMeta['components'] = list(OrderedDict.fromkeys(model_component(name) for name in modelIndex.keys()))
+
+if not modelMeta['stored']: model_meta_store(modelMeta)
+
+startupTiming['model_index'] = time.perf_counter() - startupTic - sum(startupTiming.values())
+
 # Create dictionaries parValue and parLocation
 parValue = {}
 parValue['diameter'] = 7.136
@@ -286,15 +529,242 @@ parCheck.append("parValue['start_desorption'] < parValue['stationary_desorption'
 parCheck.append("parValue['stationary_desorption'] < parValue['stop_desorption']")
 parCheck.append("parValue['start_uv'] > parValue['stop_uv']")
 
+# Switch point where a parameter first takes effect, given as the switch parameter and the scaling of its 
+# controller so that the time is parValue[switch]/scaling - used by simu_sweep(share_prefix=True) and 
+# other parameters are taken to have effect from time 0. Buffer 2 is used only from start of desorption.
+parEffect = {}
+parEffect['start_adsorption'] = ('start_adsorption', 'control_sample.scaling')
+parEffect['stop_adsorption'] = ('stop_adsorption', 'control_sample.scaling')
+parEffect['start_desorption'] = ('start_desorption', 'control_desorption_buffer.scaling')
+parEffect['x_start_desorption'] = ('start_desorption', 'control_desorption_buffer.scaling')
+parEffect['stationary_desorption'] = ('start_desorption', 'control_desorption_buffer.scaling')
+parEffect['stop_desorption'] = ('start_desorption', 'control_desorption_buffer.scaling')
+parEffect['gradient'] = ('start_desorption', 'control_desorption_buffer.scaling')
+parEffect['E_in_desorption_buffer'] = ('start_desorption', 'control_desorption_buffer.scaling')
+parEffect['start_pooling'] = ('start_pooling', 'control_pooling.scaling')
+parEffect['stop_pooling'] = ('start_pooling', 'control_pooling.scaling')
+parEffect['start_uv'] = ('start_pooling', 'control_pooling.scaling')
+parEffect['stop_uv'] = ('start_pooling', 'control_pooling.scaling')
+
+# Parameter values of the FMU as given above, used by a new Session
+parValueDefault = parValue.copy()
+
 # Create list of diagrams to be plotted by simu()
 diagrams = []
 
+# Number of column sections and substances in the column read from the model
+columnMatches = [re.fullmatch(r'column\.column_section\[(\d+)\]\.c\[(\d+)\]', name) for name in modelIndex.keys()]
+columnSections = max(int(m.group(1)) for m in columnMatches if m is not None)
+columnSpecies = max(int(m.group(2)) for m in columnMatches if m is not None)
+
+# Concentration in the column as array of shape (time, section, substance) built when first needed.
+# The tensor is kept for each result by id of sim_res together with a weak reference to it, so that results
+# of sessions in different threads are not mixed up, and the entry is removed when the result is gone
+columnTensorCache = {}
+columnTensorLock = threading.RLock()
+
+def column_tensor_drop(key, ref):
+   """ Remove the tensor of a result that is gone from columnTensorCache."""
+   with columnTensorLock:
+      if (key in columnTensorCache) and (columnTensorCache[key][0] is ref): del columnTensorCache[key]
+
+def column_concentration(sim_res_local=None):
+   """ Return array of shape (time, section, substance) with concentrations in the column sections.
+       Note that index 0 is section 1 and substance 1. Substances not logged are given as nan."""
+   if sim_res_local is None: sim_res_local = sim_res
+   key = id(sim_res_local)
+   with columnTensorLock:
+      entry = columnTensorCache.get(key)
+   if (entry is not None) and (entry[0]() is sim_res_local): return entry[1]
+   tensor = np.full((len(sim_res_local), columnSections, columnSpecies), np.nan)
+   for j in range(columnSections):
+      for i in range(columnSpecies):
+         name = 'column.column_section[' + str(j+1) + '].c[' + str(i+1) + ']'
+         if name in sim_res_local.dtype.names: tensor[:, j, i] = sim_res_local[name]
+   ref = weakref.ref(sim_res_local, lambda ref, key=key: column_tensor_drop(key, ref))
+   with columnTensorLock:
+      columnTensorCache[key] = (ref, tensor)
+   return tensor
+
+def column_moments(id, sim_res_local=None):
+   """ Return total amount per section volume and mean position in the column, in sections, 
+       for substance id over time."""
+   c = column_concentration(sim_res_local)[:, :, id-1]
+   total = c.sum(axis=1)
+   position = np.divide((c*np.arange(1, columnSections+1)).sum(axis=1), total, 
+                        out=np.full(len(total), np.nan), where=total>0)
+   return total, position
+
+def breakthrough(id, level, section=None, sim_res_local=None):
+   """ Return the first time when the concentration of substance id in a section, default the last section, 
+       exceeds level, or None if it never does."""
+   if sim_res_local is None: sim_res_local = sim_res
+   if section is None: section = columnSections
+   above = column_concentration(sim_res_local)[:, section-1, id-1] > level
+   if not above.any(): return None
+   return sim_res_local['time'][np.argmax(above)]
+
+# Pooling evaluated after simulation - control_pooling only route the column outlet to tank_harvest or
+# tank_waste and does not affect the column, and therefore many pooling windows can be evaluated from one run
+columnOutlet = ['column.column_section[' + str(columnSections) + '].outlet.c[' + str(i) + ']' 
+                for i in range(1, columnSpecies+1)]
+poolingVariables = ['ackF', 'F', 'control_pooling.scaling', 'uv_detector.value', 'tank_harvest.V'] + columnOutlet \
+                   + ['tank_harvest.m[' + str(i) + ']' for i in range(1, columnSpecies+1)]
+keyVariables.extend([name for name in poolingVariables if name not in keyVariables])
+
+def pooling_evaluate(windows=None, uv=None, sim_res_local=None, parValue=parValue):
+   """ Evaluate harvest for many pooling alternatives from one simulation without new simulation.
+       windows - list of (start_pooling, stop_pooling) in the same unit as parValue, default parValue
+       uv      - list of (start_uv, stop_uv) levels combined with the windows, default parValue
+       Windows and uv levels of the same length are evaluated pairwise, otherwise one of them must 
+       have length one. Return dictionary of arrays with harvest volume V, mass m of each substance 
+       (shape alternatives x substances), yield and purity of P, and the pooled column outlet volume interval."""
+   if sim_res_local is None: sim_res_local = sim_res
+   if windows is None: windows = [(parValue['start_pooling'], parValue['stop_pooling'])]
+   if uv is None: uv = [(parValue['start_uv'], parValue['stop_uv'])]
+   windows = np.atleast_2d(np.array(windows, dtype=float))
+   uv = np.atleast_2d(np.array(uv, dtype=float))
+   n = max(len(windows), len(uv))
+   windows = np.broadcast_to(windows, (n, 2))
+   uv = np.broadcast_to(uv, (n, 2))
+
+   # Column outlet volume and concentrations, and mass per sample interval
+   V = sim_res_local['ackF']
+   c = np.column_stack([sim_res_local[name] for name in columnOutlet])
+   dV = np.diff(V)
+   dm = 0.5*(c[1:] + c[:-1])*dV[:, None]
+
+   # Pooling windows converted from switch unit to column outlet volume
+   scaling = sim_res_local['F'][0]/sim_res_local['control_pooling.scaling'][0]
+   V_start = windows[:, 0]*scaling
+   V_stop = windows[:, 1]*scaling
+
+   # UV-hysteresis evaluated for all alternatives together sample by sample from the start of the run as in
+   # the model, where the input to the hysteresis is the UV-signal from the start of the window and zero before
+   uv_value = sim_res_local['uv_detector.value']
+   uv_on = np.zeros((n, len(V)), dtype=bool)
+   state = np.zeros(n, dtype=bool)
+   for k in range(len(V)):
+      u = np.where(V[k] >= V_start, uv_value[k], 0.0)
+      state = np.where(u > uv[:, 0], True, np.where(u < uv[:, 1], False, state))
+      uv_on[:, k] = state
+
+   # Pooling of sample intervals where the midpoint is in the window and uv-pooling is on at the start
+   V_mid = 0.5*(V[1:] + V[:-1])
+   pooled = (V_mid[None, :] >= V_start[:, None]) & (V_mid[None, :] < V_stop[:, None]) & uv_on[:, :-1]
+
+   harvest = {}
+   harvest['V'] = pooled.astype(float) @ dV
+   harvest['m'] = pooled.astype(float) @ dm
+   P_total = dm[:, 0].sum()
+   harvest['yield'] = harvest['m'][:, 0]/P_total if P_total > 0 else np.full(n, np.nan)
+   PA = harvest['m'][:, 0] + harvest['m'][:, 1]
+   harvest['purity'] = np.divide(harvest['m'][:, 0], PA, out=np.full(n, np.nan), where=PA>0)
+   any_pooled = pooled.any(axis=1)
+   harvest['V_first'] = np.where(any_pooled, V[:-1][np.argmax(pooled, axis=1)], np.nan)
+   harvest['V_last'] = np.where(any_pooled, V[1:][len(dV) - 1 - np.argmax(pooled[:, ::-1], axis=1)], np.nan)
+   return harvest
+
+def pooling_check(windows=None, uv=None, simulationTime=simulationTime, decimals=3):
+   """ Compare pooling_evaluate() from one simulation with new simulations for a grid of pooling windows 
+       and uv levels, default around present parValue. Print harvest volume and mass of each substance, 
+       evaluated and simulated, and return the largest difference of harvest volume."""
+   if windows is None: 
+      start, stop = parValue['start_pooling'], parValue['stop_pooling']
+      windows = [(start, stop), (start, 0.5*(start + stop)), (0.5*(start + stop), stop)]
+   if uv is None: 
+      uv = [(parValue['start_uv'], parValue['stop_uv']), (-1, -2), (0.1, 0.05), (0.2, 0.1), (0.3, 0.01)]
+   grid = list(dict.fromkeys((tuple(window), tuple(level)) for window in windows for level in uv))
+   output = list(set(poolingVariables + kpiVariables + list(stateValue.keys())))
+   reference = sweep_scenario({}, simulationTime, output=output)
+   if reference['error'] is not None: raise RuntimeError(reference['error'])
+   harvest = pooling_evaluate(windows=[window for window, level in grid], uv=[level for window, level in grid],
+                              sim_res_local=reference['sim_res'])
+   print('start_pooling stop_pooling start_uv stop_uv - harvest V and m evaluated / simulated')
+   difference = 0
+   for k, (window, level) in enumerate(grid):
+      scenario = {'start_pooling': window[0], 'stop_pooling': window[1], 'start_uv': level[0], 'stop_uv': level[1]}
+      result = sweep_scenario(scenario, simulationTime, output=output)
+      if result['error'] is not None:
+         print(window, level, '- simulation failed:', result['error'])
+         continue
+      sim_res_local = result['sim_res']
+      V_model = sim_res_local['tank_harvest.V'][-1] - sim_res_local['tank_harvest.V'][0]
+      m_model = [sim_res_local['tank_harvest.m[' + str(i+1) + ']'][-1] - sim_res_local['tank_harvest.m[' + str(i+1) + ']'][0]
+                 for i in range(columnSpecies)]
+      print(np.round(window, decimals), np.round(level, decimals), '-', np.round(harvest['V'][k], decimals), '/',
+            np.round(V_model, decimals), ' ', np.round(harvest['m'][k], decimals), '/', np.round(m_model, decimals))
+      difference = max(difference, abs(harvest['V'][k] - V_model))
+   return difference
+
+# Key performance indicators of one or many simulations computed from the first and last sample
+kpiVariables = ['time', 'column.V_m', 'column.V', 'tank_sample.V', 'tank_sample.outlet.c[1]', 
+                'tank_buffer1.V', 'tank_buffer2.V', 'tank_harvest.V', 'tank_harvest.m[1]', 'tank_harvest.m[2]',
+                'tank_waste.m[1]', 'tank_waste.m[2]', 'tank_mixing.m[1]'] \
+               + ['column.column_section[' + str(j) + '].c[' + str(i) + ']' 
+                  for j in range(1, columnSections+1) for i in [1, 4]]
+keyVariables.extend([name for name in kpiVariables if (name not in keyVariables) and (name in modelIndex)])
+
+kpiNames = ['P_harvest', 'A_harvest', 'V_harvest', 'yield', 'purity', 'productivity', 'productivity_CV', 
+            'buffer1', 'buffer2', 'dilution', 'mass_balance', 'duration']
+
+def kpi(runs=None):
+   """ Return table of key performance indicators for one simulation result or a list of results,
+       sim_res or results from simu_sweep(), default sim_res. The table is a structured array with one row 
+       per run and columns:
+        - P_harvest, A_harvest [mg] and V_harvest [mL] collected in tank_harvest
+        - yield of P in harvest relative P leaving the column, and purity P/(P+A) in harvest
+        - productivity [mg/h] and productivity_CV [mg/(mL column h)] of P in harvest
+        - buffer1 and buffer2 consumption [mL]
+        - dilution as concentration of P in sample relative in harvest
+        - mass_balance as P in harvest, waste, mixing tank and column relative P loaded, should be 1
+        - duration of the run [h]
+       Failed runs give nan."""
+   if runs is None: runs = [sim_res]
+   if isinstance(runs, np.ndarray): runs = [runs]
+   runs = [run['sim_res'] if isinstance(run, dict) else run for run in runs]
+   valid = np.array([run is not None for run in runs])
+   validRuns = [run for run in runs if run is not None]
+
+   # First and last value of each variable as arrays over runs
+   first = {}
+   last = {}
+   for name in kpiVariables:
+      first[name] = np.array([run[name][0] for run in validRuns], dtype=float)
+      last[name] = np.array([run[name][-1] for run in validRuns], dtype=float)
+   delta = {name: last[name] - first[name] for name in kpiVariables}
+
+   # Substance P in the column is free P and bound PS, both related to the mobile phase volume
+   sectionVolume = first['column.V_m']/columnSections
+   holdup = sum(delta['column.column_section[' + str(j) + '].c[' + str(i) + ']'] 
+                for j in range(1, columnSections+1) for i in [1, 4])*sectionVolume
+   P_loaded = -delta['tank_sample.V']*first['tank_sample.outlet.c[1]']
+
+   with np.errstate(divide='ignore', invalid='ignore'):
+      table = {}
+      table['P_harvest'] = delta['tank_harvest.m[1]']
+      table['A_harvest'] = delta['tank_harvest.m[2]']
+      table['V_harvest'] = delta['tank_harvest.V']
+      table['yield'] = table['P_harvest']/(table['P_harvest'] + delta['tank_waste.m[1]'])
+      table['purity'] = table['P_harvest']/(table['P_harvest'] + table['A_harvest'])
+      table['duration'] = delta['time']/60
+      table['productivity'] = table['P_harvest']/table['duration']
+      table['productivity_CV'] = table['productivity']/first['column.V']
+      table['buffer1'] = -delta['tank_buffer1.V']
+      table['buffer2'] = -delta['tank_buffer2.V']
+      table['dilution'] = first['tank_sample.outlet.c[1]']/(table['P_harvest']/table['V_harvest'])
+      table['mass_balance'] = (table['P_harvest'] + delta['tank_waste.m[1]'] + delta['tank_mixing.m[1]'] 
+                               + holdup)/P_loaded
+
+   result = np.full(len(runs), np.nan, dtype=[(name, float) for name in kpiNames])
+   for name in kpiNames: result[name][valid] = table[name]
+   return result
+
 # Define standard plots
 def profile(t_n, id):
-    data = np.zeros(9)
+    data = np.zeros(columnSections+1)
     data[0] = sim_res['time'][t_n]
-    for j in list(range(1,9)):
-        data[j] = sim_res['column.column_section[' + str(j) + '].c[' + str(id) + ']'][t_n]
+    data[1:] = column_concentration()[t_n, :, id-1]
     return data
 
 def newplot(title='IEC', plotType='Loading'):
@@ -304,6 +774,13 @@ def newplot(title='IEC', plotType='Loading'):
    # Globals
    global ax1, ax2, ax3, ax4, ax5, ax6    
    global ax11, ax12, ax21, ax22
+
+   # In headless mode diagrams are updated as usual, so that simu() gives the same sim_res, but no figure is made
+   if plotSetup['headless']:
+      plt = PlotNull()
+   else:
+      matplotlib_import()
+      plt = globals()['plt']
     
    # Reset pens
    setLines()
@@ -326,28 +803,28 @@ def newplot(title='IEC', plotType='Loading'):
       
       # Part of plot made after simulation
       diagrams.clear()
-      diagrams.append("ax1.plot(list(range(1,9)), profile(10,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(50,4)[1:], 'b')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(150,4)[1:], 'b')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(200,4)[1:], 'b')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(250,4)[1:], 'b')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(300,4)[1:], 'b')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(350,4)[1:], 'b')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(400,4)[1:], 'b')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(450,4)[1:], 'b')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(500,4)[1:], 'b')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(10,5)[1:], 'r')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(50,5)[1:], 'r')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(150,5)[1:], 'r')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(200,5)[1:], 'r')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(250,5)[1:], 'r')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(300,5)[1:], 'r')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(350,5)[1:], 'r')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(400,5)[1:], 'r')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(450,5)[1:], 'r')")
-      diagrams.append("ax1.plot(list(range(1,9)), profile(500,5)[1:], 'r')")
-      diagrams.append("ax2.plot(list(range(1,9)), profile(500,4)[1:], 'b*-')")      
-      diagrams.append("ax2.plot(list(range(1,9)), profile(500,5)[1:], 'r*-')")      
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(10,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(50,4)[1:], 'b')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(150,4)[1:], 'b')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(200,4)[1:], 'b')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(250,4)[1:], 'b')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(300,4)[1:], 'b')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(350,4)[1:], 'b')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(400,4)[1:], 'b')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(450,4)[1:], 'b')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(500,4)[1:], 'b')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(10,5)[1:], 'r')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(50,5)[1:], 'r')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(150,5)[1:], 'r')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(200,5)[1:], 'r')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(250,5)[1:], 'r')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(300,5)[1:], 'r')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(350,5)[1:], 'r')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(400,5)[1:], 'r')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(450,5)[1:], 'r')")
+      diagrams.append("ax1.plot(list(range(1,columnSections+1)), profile(500,5)[1:], 'r')")
+      diagrams.append("ax2.plot(list(range(1,columnSections+1)), profile(500,4)[1:], 'b*-')")      
+      diagrams.append("ax2.plot(list(range(1,columnSections+1)), profile(500,5)[1:], 'r*-')")      
         
    elif plotType == 'Loading-combined':
       
@@ -376,29 +853,29 @@ def newplot(title='IEC', plotType='Loading'):
       # Part of plot made after simulation
       diagrams.clear()    
       diagrams.append("ax11.plot(sim_res['time'], sim_res['tank_mixing.outlet.c[1]'], color='b', linestyle=linetype)")           
-      diagrams.append("ax12.plot(list(range(1,9)), profile(10,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(50,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(150,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(200,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(250,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(300,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(350,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(400,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(450,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(500,4)[1:], color='b', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(10,5)[1:], color='r', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(50,5)[1:], color='r', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(150,5)[1:], color='r', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(200,5)[1:], color='r', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(250,5)[1:], color='r', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(300,5)[1:], color='r', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(350,5)[1:], color='r', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(400,5)[1:], color='r', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(450,5)[1:], color='r', linestyle=linetype)")
-      diagrams.append("ax12.plot(list(range(1,9)), profile(500,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(10,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(50,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(150,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(200,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(250,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(300,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(350,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(400,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(450,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(500,4)[1:], color='b', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(10,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(50,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(150,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(200,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(250,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(300,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(350,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(400,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(450,5)[1:], color='r', linestyle=linetype)")
+      diagrams.append("ax12.plot(list(range(1,columnSections+1)), profile(500,5)[1:], color='r', linestyle=linetype)")
       diagrams.append("ax21.plot(sim_res['time'], sim_res['tank_waste.V'], color='b', linestyle=linetype)")
-      diagrams.append("ax22.plot(list(range(1,9)), profile(500,4)[1:], color='b', linestyle=linetype)")      
-      diagrams.append("ax22.plot(list(range(1,9)), profile(500,5)[1:], color='r', linestyle=linetype)")  
+      diagrams.append("ax22.plot(list(range(1,columnSections+1)), profile(500,4)[1:], color='b', linestyle=linetype)")      
+      diagrams.append("ax22.plot(list(range(1,columnSections+1)), profile(500,5)[1:], color='r', linestyle=linetype)")  
       
    elif plotType == 'Elution':
       
@@ -1005,6 +1482,26 @@ def newplot(title='IEC', plotType='Loading'):
        
       diagrams.append("ax3.step(sim_res['time'], sim_res['control_pooling.out'], color='k', linestyle=linetype)")
 
+   elif plotType == 'Loading-heatmap':
+         
+      # Part of plot made before simulation
+      plt.figure()
+      ax1 = plt.subplot(2,1,1)
+      ax2 = plt.subplot(2,1,2)
+    
+      ax1.set_title(title)
+      ax1.set_ylabel('Section c[PS]')
+    
+      ax2.set_ylabel('Section c[AS]')
+      ax2.set_xlabel('Time [min]')       
+
+      # Part of plot made after simulation
+      diagrams.clear()
+      diagrams.append("ax1.imshow(column_concentration()[:,:,3].T, aspect='auto', origin='lower', cmap='Blues', \
+                                extent=[sim_res['time'][0], sim_res['time'][-1], 0.5, columnSections+0.5])")
+      diagrams.append("ax2.imshow(column_concentration()[:,:,4].T, aspect='auto', origin='lower', cmap='Reds', \
+                                extent=[sim_res['time'][0], sim_res['time'][-1], 0.5, columnSections+0.5])")
+
    elif plotType == 'Column-outlet':
          
       # Part of plot made before simulation
@@ -1033,6 +1530,9 @@ def newplot(title='IEC', plotType='Loading'):
    else:
       print("Plot window type not correct") 
 
+   # Parse and compile diagrams once
+   for command in diagrams: diagram_compile(command)
+
 # Define and extend describe for the current application
 def describe(name, decimals=3):
    """Look up description of culture, media, as well as parameters and variables in the model code"""
@@ -1088,11 +1588,16 @@ def par(*x, parValue=parValue, **x_kwarg):
          print('Error:', key, '- seems not an accessible parameter - check the spelling')
    parValue.update(x_temp)
    
-   parErrors = [requirement for requirement in parCheck if not(eval(requirement))]
+   parErrors = par_check(parValue)
    if not parErrors == []:
       print('Error - the following requirements do not hold:')
       for index, item in enumerate(parErrors): print(item)
 
+# Define function par_check() that evaluate the requirements in parCheck
+def par_check(parValue=parValue):
+   """ Return the list of requirements in parCheck that do not hold for parValue. """
+   return [requirement for requirement in parCheck if not(eval(requirement))]
+
 # Define function init() for initial values update
 def init(*x, parValue=parValue, **x_kwarg):
    """ Set initial values and the name should contain string '_start' to be accepted.
@@ -1128,44 +1633,53 @@ def readParLocation(file, sheets, parLocation=parLocation):
    parLocation.update(parLocation_local)
 
 # Define fuctions similar to pyfmi model.get(), model.get_variable_descirption(), model.get_variable_unit()
-def model_get(parLoc, model_description=model_description):
-   """ Function corresponds to pyfmi model.get() but returns just a value and not a list"""
-   par_var = model_description.modelVariables
-   for k in range(len(par_var)):
-      if par_var[k].name == parLoc:
-         try:
-            if (par_var[k].causality in ['local']) & (par_var[k].variability in ['constant']):
-               value = float(par_var[k].start)                 
-            elif par_var[k].causality in ['parameter']: 
-               value = float(par_var[k].start)  
-            elif par_var[k].causality in ['calculatedParameter']: 
-               value = float(sim_res[par_var[k].name][0]) 
-            elif par_var[k].name in start_values.keys():
-               value = start_values[par_var[k].name]   
-            elif par_var[k].variability == 'continuous':
-               try:
-                  timeSeries = sim_res[par_var[k].name]
-                  value = float(timeSeries[-1])
-               except (AttributeError, ValueError):
-                  value = None
-                  print('Variable not logged')
-            else:
+def model_start(var):
+   """ Return the start value of a variable in modelIndex, as np.bool_ for Boolean and as is for String."""
+   if var['type'] == 'Boolean': return np.bool_(var['start'] in ['true', '1'])
+   if var['type'] == 'String': return var['start']
+   return float(var['start'])
+
+def model_get(parLoc, modelIndex=modelIndex, sim_res_local=None, start_values_local=None):
+   """ Function corresponds to pyfmi model.get() but returns just a value and not a list.
+       Values are taken from sim_res and start_values, or from the given ones, e.g. of a Session."""
+   value = None
+   if parLoc in modelIndex:
+      var = modelIndex[parLoc]
+      try:
+         if sim_res_local is None: sim_res_local = sim_res
+         if start_values_local is None: start_values_local = start_values
+         if (var['causality'] in ['local']) & (var['variability'] in ['constant']):
+            value = model_start(var)
+         elif var['causality'] in ['parameter']:
+            value = model_start(var)
+         elif var['causality'] in ['calculatedParameter']:
+            value = float(sim_res_local[parLoc][0])
+         elif parLoc in start_values_local.keys():
+            value = start_values_local[parLoc]
+         elif var['variability'] == 'continuous':
+            try:
+               timeSeries = sim_res_local[parLoc]
+               value = float(timeSeries[-1])
+            except (AttributeError, ValueError):
                value = None
-         except NameError:
-            print('Error: Information available after first simution')
-            value = None          
+               print('Variable not logged')
+         else:
+            value = None
+      except NameError:
+         print('Error: Information available after first simution')
+         value = None
    return value
 
-def model_get_variable_description(parLoc, model_description=model_description):
+def model_get_variable_description(parLoc, modelIndex=modelIndex):
    """ Function corresponds to pyfmi model.get_variable_description() but returns just a value and not a list"""
-   par_var = model_description.modelVariables
-   value = [x.description for x in par_var if parLoc in x.name]   
+   if parLoc in modelIndex: return modelIndex[parLoc]['description']
+   value = [x['description'] for name, x in modelIndex.items() if parLoc in name]
    return value[0]
-   
-def model_get_variable_unit(parLoc, model_description=model_description):
+
+def model_get_variable_unit(parLoc, modelIndex=modelIndex):
    """ Function corresponds to pyfmi model.get_variable_unit() but returns just a value and not a list"""
-   par_var = model_description.modelVariables
-   value = [x.unit for x in par_var if parLoc in x.name]
+   if parLoc in modelIndex: return modelIndex[parLoc]['unit']
+   value = [x['unit'] for name, x in modelIndex.items() if parLoc in name]
    return value[0]
       
 # Define function disp() for display of initial values and parameters
@@ -1216,136 +1730,1195 @@ def setLines(lines=['-','--',':','-.']):
    global linecycler
    linecycler = cycle(lines)
 
+# Compiled diagrams - each diagram string is parsed once into the exact sim_res keys it needs and compiled code
+Diagram = namedtuple('Diagram', ['source', 'keys', 'code'])
+diagramCache = {}
+
+def diagram_compile(command):
+   """ Return the compiled Diagram of a diagram string with the model variables needed in sim_res."""
+   if command not in diagramCache:
+      names = set(re.findall(r"sim_res\[\s*'([^']+)'\s*\]", command))
+      names.update(re.findall(r'sim_res\[\s*"([^"]+)"\s*\]', command))
+      for name in re.findall(r"model_get\(\s*'([^']+)'\s*\)", command):
+         if name in modelIndex:
+            if modelIndex[name]['causality'] in ['local', 'calculatedParameter']: names.add(name)
+      for t_n, id in re.findall(r'profile\(\s*([^,()]+)\s*,\s*([^,()]+)\s*\)', command):
+         names.update(profile_keys(id))
+      if 'column_concentration(' in command: names.update(profile_keys(''))
+      keys = frozenset(name for name in names if name in modelIndex)
+      diagramCache[command] = Diagram(command, keys, compile(command, '<diagram>', 'eval'))
+   return diagramCache[command]
+
+def profile_keys(id):
+   """ Return the sim_res keys used by profile() for substance id, or for all substances if id not a number."""
+   if str(id).strip().isdigit():
+      return ['column.column_section[' + str(j) + '].c[' + str(id).strip() + ']' for j in range(1,columnSections+1)]
+   else:
+      return [name for name in modelIndex.keys() if re.fullmatch(r'column\.column_section\[\d+\]\.c\[\d+\]', name)]
+
+def diagram_plot(diagrams, linetype):
+   """ Evaluate the compiled diagrams with the given linetype."""
+   for command in diagrams: eval(diagram_compile(command).code, globals(), {'linetype': linetype})
+
 # Show plots from sim_res, just that
 def show(diagrams=diagrams):
    """Show diagrams chosen by newplot()"""
+   if plotSetup['headless']:
+      print('Headless mode - no diagrams shown')
+      return
    # Plot pen
    linetype = next(linecycler)    
    # Plot diagrams 
-   for command in diagrams: eval(command)
+   diagram_plot(diagrams, linetype)
+
+# Help function to extract variables to be stored - the union of the keys of the compiled diagrams
+def extract_variables(diagrams):
+    output = set()
+    for command in diagrams: output.update(diagram_compile(command).keys)
+    return list(output)
+
+# Timing of the phases of simu() - each Session has last_timing that holds the last call and timingProfile 
+# that accumulates over calls, and the module last_timing and timingProfile are those of the default session.
+# Functions below that take timing add to the Session given, and nothing is added when timing is None
+#   load        - extraction of the FMU and check of the extracted directory
+#   instantiate - instantiation, or reset(), of the FMU and setting of start values
+#   initialize  - from start of integration to the first step done, includes initialization of the FMU
+#                 and for fmu_cached=False also extraction and instantiation
+#   integrate   - integration with recording of the result
+#   result      - lookup and store in the result cache
+#   state       - capture of the final state in stateValue
+#   plot        - evaluation and plot of diagrams
+timingPhases = ['load', 'instantiate', 'initialize', 'integrate', 'result', 'state', 'plot']
+last_timing = {}
+timingProfile = {'enabled': True, 'simu': 0, 'phases': {}}
+
+def timing_add(phase, tic, toc=None, timing=None):
+   """ Add time from tic to toc, or now, to the phase in last_timing and timingProfile of the Session timing
+       if given and return toc."""
+   if toc is None: toc = time.perf_counter()
+   if timing is None: return toc
+   timings = [timing.last_timing]
+   if timing.timingProfile['enabled']: timings.append(timing.timingProfile['phases'])
+   for timing in timings:
+      if phase not in timing: timing[phase] = {'time': 0.0, 'calls': 0}
+      timing[phase]['time'] = timing[phase]['time'] + toc - tic
+      timing[phase]['calls'] = timing[phase]['calls'] + 1
+   return toc
+
+def timing_info(cumulative=False, timing=None):
+   """ Print time and calls for each phase of the last simu(), or with cumulative=True of all simu() calls,
+       of the Session timing, default the default session."""
+   if timing is None: timing = session
+   if cumulative:
+      print('Profile of', timing.timingProfile['simu'], 'simu() calls')
+      timing = timing.timingProfile['phases']
+   else:
+      timing = timing.last_timing
+      print('Timing of last simu()')
+   total = sum(timing[phase]['time'] for phase in timing.keys())
+   for phase in timingPhases:
+      if phase in timing.keys():
+         print(' -' + phase.ljust(12), format(1000*timing[phase]['time'], '10.1f'), 'ms', \
+               format(100*timing[phase]['time']/max(total, 1e-12), '6.1f'), '%', \
+               ' calls:', timing[phase]['calls'])
+   print(' -' + 'total'.ljust(12), format(1000*total, '10.1f'), 'ms')
+
+def timing_reset(timing=None):
+   """ Clear last_timing and the cumulative timingProfile of the Session timing, default the default session."""
+   if timing is None: timing = session
+   timing.last_timing.clear()
+   timing.timingProfile['simu'] = 0
+   timing.timingProfile['phases'].clear()
+
+# FMI call statistics - fmi_call_logger() is a hook for simu(fmi_call_logger=fmi_call_logger) that count
+# the calls of each FMI function and make a histogram of the latency with bins given by fmiCallBins in s.
+# The latency is taken as the time since the previous FMI call returned and include Python code in between.
+fmiCallBins = np.array([1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1])
+fmiCallStat = {}
+fmiCallClock = {'last': None}
+
+def fmi_call_logger(message):
+   """ Aggregate an FMI call logged by FMPy in fmiCallStat instead of printing it."""
+   now = time.perf_counter()
+   name = message.split('(')[0].strip()
+   if name not in fmiCallStat:
+      fmiCallStat[name] = {'calls': 0, 'time': 0.0, 'histogram': np.zeros(len(fmiCallBins)+1, dtype=int)}
+   fmiCallStat[name]['calls'] = fmiCallStat[name]['calls'] + 1
+   if fmiCallClock['last'] is not None:
+      latency = now - fmiCallClock['last']
+      fmiCallStat[name]['time'] = fmiCallStat[name]['time'] + latency
+      fmiCallStat[name]['histogram'][np.searchsorted(fmiCallBins, latency)] += 1
+   fmiCallClock['last'] = time.perf_counter()
+
+def fmi_call_info():
+   """ Print number of calls, total time and latency histogram for each FMI function."""
+   print('FMI calls - latency histogram with bin edges', ', '.join(format(x, 'g') for x in fmiCallBins), 's')
+   for name in sorted(fmiCallStat.keys(), key=lambda name: -fmiCallStat[name]['time']):
+      stat = fmiCallStat[name]
+      print(' -' + name.ljust(32), format(stat['calls'], '8d'), 'calls', format(1000*stat['time'], '10.1f'), 'ms', \
+            ' ', stat['histogram'])
+
+def fmi_call_reset():
+   """ Clear fmiCallStat."""
+   fmiCallStat.clear()
+   fmiCallClock['last'] = None
+
+# Cached FMU backend - the FMU is extracted once and the instance is kept and reset() between simulations
+fmuCache = {'dir': None, 'instance': None, 'runs': 0, 'timing': {}}
+
+def fmu_extract(fmu_model=fmu_model):
+   """ Extract the FMU once to a directory named by the SHA-256 of the FMU-file and return the directory.
+       The directory is kept between sessions in fmu_cache_dir() and a changed FMU-file gives a new directory."""
+   digest = fmu_sha256(fmu_model)
+   cachedir = fmu_cache_dir()
+   unzipdir = os.path.join(cachedir, 'fmu_' + os.path.splitext(os.path.basename(fmu_model))[0] + '_' + digest[:16])
+   if not os.path.isfile(os.path.join(unzipdir, 'modelDescription.xml')):
+      fmpy_simulation_import()
+      tic = time.perf_counter()
+      tmpdir = tempfile.mkdtemp(dir=cachedir)
+      extract(fmu_model, unzipdir=tmpdir)
+      try:
+         os.replace(tmpdir, unzipdir)
+      except OSError:
+         # Another process extracted the same FMU meanwhile
+         shutil.rmtree(tmpdir, ignore_errors=True)
+      fmuCache['timing']['extract'] = time.perf_counter() - tic
+   return unzipdir
+
+def fmu_instance_get(fmu_model=fmu_model, fmu_cache=None, timing=None):
+   """ Return the instantiated FMU kept in fmu_cache, default fmuCache, and create it the first time."""
+   if fmu_cache is None: fmu_cache = fmuCache
+   if fmu_cache['instance'] is None:
+      tic = time.perf_counter()
+      fmu_cache['dir'] = fmu_extract(fmu_model)
+      fmpy_simulation_import()
+      tic = timing_add('load', tic, timing=timing)
+      if flag_type in ['ME', 'me']:
+         fmi_type = 'ModelExchange'
+      else:
+         fmi_type = 'CoSimulation'
+      fmu_cache['instance'] = instantiate_fmu(fmu_cache['dir'], model_description_get(), fmi_type=fmi_type)
+      fmu_cache['timing']['instantiate'] = time.perf_counter() - tic
+      timing_add('instantiate', tic, timing=timing)
+   return fmu_cache['instance']
+
+def fmu_free(fmu_cache=None):
+   """ Free the FMU instance kept in fmu_cache, default fmuCache - the extracted directory is kept."""
+   if fmu_cache is None: fmu_cache = fmuCache
+   if fmu_cache['instance'] is not None:
+      try:
+         fmu_cache['instance'].freeInstance()
+      except Exception:
+         pass
+      fmu_cache['instance'] = None
+
+atexit.register(fmu_free)
+
+# Pool of FMU instances for threads - the FMU can be instantiated many times in one process and the FMI calls
+# release the GIL, so instances in different threads integrate in parallel. A thread takes an instance from 
+# the pool for one simulation and gives it back, and a new instance is made only when none is free
+fmuPool = queue.Queue()
+fmuPoolCaches = []
+
+def fmu_pool_acquire():
+   """ Return a free FMU cache from fmuPool, or a new one that fmu_simulate() instantiates when first used."""
+   try:
+      return fmuPool.get_nowait()
+   except queue.Empty:
+      fmu_cache = {'dir': None, 'instance': None, 'runs': 0, 'timing': {}}
+      fmuPoolCaches.append(fmu_cache)
+      return fmu_cache
+
+def fmu_pool_release(fmu_cache):
+   """ Give back an FMU cache to fmuPool."""
+   fmuPool.put(fmu_cache)
+
+def fmu_pool_free():
+   """ Free the FMU instances of fmuPool."""
+   for fmu_cache in fmuPoolCaches: fmu_free(fmu_cache)
+
+atexit.register(fmu_pool_free)
+
+# Result cache - simulation results kept by a hash of FMU GUID, start_values, time horizon and output variables
+# in a memory tier with LRU eviction and optionally in a disk tier with eviction of the least recently used files
+resultCache = {'enabled': True, 'memory_bytes': 256e6, 'disk_dir': None, 'disk_bytes': 2e9}
+resultCacheMemory = OrderedDict()
+resultCacheStat = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+resultCacheLock = threading.RLock()
+
+def result_cache_key(start_values, start_time, stop_time, output_interval, output, stop=[]):
+   """ Return the key of a simulation as SHA-256 hex digest."""
+   def normalize(value):
+      if isinstance(value, (bool, np.bool_)): return bool(value)
+      if isinstance(value, (int, float, np.number)): return float(value)
+      return value
+   content = (modelMeta['guid'],
+              sorted((key, normalize(value)) for key, value in start_values.items()),
+              float(start_time), float(stop_time), float(output_interval),
+              sorted(output) if output is not None else None,
+              stop)
+   return hashlib.sha256(repr(content).encode()).hexdigest()
+
+def result_cache_get(key):
+   """ Return a copy of the cached result for key or None, first from memory and then from disk."""
+   with resultCacheLock:
+      return result_cache_get_locked(key)
+
+def result_cache_get_locked(key):
+   if key in resultCacheMemory:
+      resultCacheMemory.move_to_end(key)
+      resultCacheStat['hits'] = resultCacheStat['hits'] + 1
+      return resultCacheMemory[key].copy()
+   if resultCache['disk_dir'] is not None:
+      path = os.path.join(resultCache['disk_dir'], key + '.npy')
+      try:
+         sim_res_local = np.load(path, allow_pickle=False)
+         os.utime(path)
+      except (OSError, ValueError):
+         sim_res_local = None
+      if sim_res_local is not None:
+         resultCacheStat['disk_hits'] = resultCacheStat['disk_hits'] + 1
+         result_cache_put(key, sim_res_local, disk=False)
+         return sim_res_local.copy()
+   resultCacheStat['misses'] = resultCacheStat['misses'] + 1
+   return None
+
+def result_cache_put(key, sim_res_local, disk=True):
+   """ Store a result in the memory tier and, if resultCache['disk_dir'] is given, also in the disk tier."""
+   with resultCacheLock:
+      result_cache_put_locked(key, sim_res_local, disk)
+
+def result_cache_put_locked(key, sim_res_local, disk=True):
+   resultCacheMemory[key] = sim_res_local.copy()
+   resultCacheMemory.move_to_end(key)
+   while (sum(x.nbytes for x in resultCacheMemory.values()) > resultCache['memory_bytes']) \
+         & (len(resultCacheMemory) > 1):
+      resultCacheMemory.popitem(last=False)
+   if disk & (resultCache['disk_dir'] is not None):
+      os.makedirs(resultCache['disk_dir'], exist_ok=True)
+      path = os.path.join(resultCache['disk_dir'], key + '.npy')
+      tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+      with open(tmp_path, 'wb') as f:
+         np.save(f, sim_res_local, allow_pickle=False)
+      os.replace(tmp_path, path)
+      result_cache_evict_disk()
+
+def result_cache_evict_disk():
+   """ Remove the least recently used files of the disk tier until within resultCache['disk_bytes']."""
+   files = [entry for entry in os.scandir(resultCache['disk_dir']) if entry.name.endswith('.npy')]
+   files = sorted(files, key=lambda entry: entry.stat().st_mtime)
+   size = sum(entry.stat().st_size for entry in files)
+   for entry in files:
+      if size <= resultCache['disk_bytes']: break
+      size = size - entry.stat().st_size
+      try:
+         os.remove(entry.path)
+      except OSError:
+         pass
+
+def result_cache_clear(disk=False):
+   """ Clear the memory tier and with disk=True also the disk tier of the result cache."""
+   resultCacheMemory.clear()
+   if disk & (resultCache['disk_dir'] is not None):
+      for entry in os.scandir(resultCache['disk_dir']):
+         if entry.name.endswith('.npy'): os.remove(entry.path)
+
+def result_cache_info():
+   """ Print size and hit statistics of the result cache."""
+   print('Result cache')
+   print(' -Memory:', len(resultCacheMemory), 'results', \
+         np.round(sum(x.nbytes for x in resultCacheMemory.values())/1e6, 1), 'MB')
+   print(' -Disk:', resultCache['disk_dir'])
+   print(' -Hits memory:', resultCacheStat['hits'], ' hits disk:', resultCacheStat['disk_hits'], \
+         ' misses:', resultCacheStat['misses'])
+
+# Stop conditions - evaluated after each step and the simulation ends when any of them holds
+# Given as tuples that can be cached and sent to worker processes:
+#   ('when', name, op, value)          - e.g. ('when', 'ackF', '>=', 300)
+#   ('pooling_done',)                  - control_pooling.out has been on and is back to off
+#   ('steady', name, tolerance, time)  - variable changed once and then within tolerance for the given time
+# or given as a function f(time, get) that return True to stop where get(name) gives the present value
+stopOperators = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, 
+                 '==': operator.eq, '!=': operator.ne}
+
+def stop_condition(condition):
+   """ Return a new stop condition function f(time, get) from a tuple, or the function itself."""
+   if not isinstance(condition, tuple): return condition
+
+   if condition[0] == 'when':
+      name, op, value = condition[1:]
+      return lambda time, get: stopOperators[op](get(name), value)
+
+   elif condition[0] == 'pooling_done':
+      pooling = {'on': False}
+      def pooling_done(time, get):
+         if get('control_pooling.out') > 0.5: 
+            pooling['on'] = True
+            return False
+         return pooling['on']
+      return pooling_done
+
+   elif condition[0] == 'steady':
+      name, tolerance, duration = condition[1:]
+      steady = {'value': None, 'time': None, 'changed': False}
+      def steady_state(time, get):
+         value = get(name)
+         if (steady['value'] is None) or (abs(value - steady['value']) > tolerance):
+            steady['changed'] = steady['value'] is not None
+            steady['value'] = value
+            steady['time'] = time
+            return False
+         return steady['changed'] & (time - steady['time'] >= duration)
+      return steady_state
+
+   else:
+      raise ValueError('Stop condition not known: ' + str(condition[0]))
+
+def fmu_value(fmu, name):
+   """ Return the present value of a model variable from an FMU instance."""
+   var = modelIndex[name]
+   vr = [var['valueReference']]
+   if var['type'] == 'Real':
+      return fmu.getReal(vr)[0]
+   elif var['type'] in ['Integer', 'Enumeration']:
+      return fmu.getInteger(vr)[0]
+   elif var['type'] == 'Boolean':
+      return fmu.getBoolean(vr)[0]
+   else:
+      return fmu.getString(vr)[0]
+
+# Set values in the FMU instance with one call per type - the value references are grouped once for each
+# set of variable names and kept in fmuSetPlan
+fmuSetPlan = {}
+
+def fmu_set_plan(names):
+   """ Return list of (type, positions in names, value references) for variable names."""
+   if names not in fmuSetPlan:
+      groups = {}
+      for position, name in enumerate(names):
+         var = modelIndex[name]
+         if var['type'] not in groups: groups[var['type']] = ([], [])
+         groups[var['type']][0].append(position)
+         groups[var['type']][1].append(var['valueReference'])
+      fmuSetPlan[names] = [(varType, positions, vrs) for varType, (positions, vrs) in groups.items()]
+   return fmuSetPlan[names]
+
+def fmu_set_values(fmu, values):
+   """ Set a dictionary of variable names and values in an FMU instance with one call per type."""
+   valueList = list(values.values())
+   for varType, positions, vrs in fmu_set_plan(tuple(values.keys())):
+      typeValues = [valueList[position] for position in positions]
+      if varType == 'Real':
+         fmu.setReal(vrs, [float(value) for value in typeValues])
+      elif varType in ['Integer', 'Enumeration']:
+         fmu.setInteger(vrs, [int(value) for value in typeValues])
+      elif varType == 'Boolean':
+         fmu.setBoolean(vrs, [bool(value) for value in typeValues])
+      else:
+         fmu.setString(vrs, [str(value) for value in typeValues])
+
+def fmu_simulate(start_values, start_time, stop_time, options=opts_std, output=None, fmu_model=fmu_model, \
+                 fmu_cached=True, stop=None, fmi_call_logger=None, fmu_cache=None, cancel=None, timing=None, \
+                 **kwargs):
+   """ Simulate the FMU from start_time to stop_time with given start_values and return sim_res.
+       With fmu_cached=True the FMU instance in fmu_cache, default fmuCache, is reset() and reused.
+       The simulation ends early when any of the stop conditions holds, see stop_condition().
+       Each FMI call is given to fmi_call_logger(message) if given, e.g. the aggregating fmi_call_logger().
+       Results are memoized in resultCache unless extra simulate_fmu() arguments, stop conditions as
+       functions or fmi_call_logger are given. Time of each phase is added to the Session timing if given.
+       With cancel given as a threading.Event the simulation ends at the next output step after it is set
+       and CancelledError is raised."""
+   output_interval = (stop_time - start_time)/options['NCP']
+   if stop is None: stop = []
+   tic = time.perf_counter()
+   cacheable = (kwargs == {}) & all(isinstance(condition, tuple) for condition in stop) \
+               & (fmi_call_logger is None)
+   if resultCache['enabled'] & cacheable:
+      key = result_cache_key(start_values, start_time, stop_time, output_interval, output, stop)
+      sim_res_cached = result_cache_get(key)
+      timing_add('result', tic, timing=timing)
+      if sim_res_cached is not None: return sim_res_cached
+   else:
+      key = None
+
+   step_finished = kwargs.pop('step_finished', None)
+   if fmu_cache is None: fmu_cache = fmuCache
+   if fmu_cached:
+      fmu = fmu_instance_get(fmu_model, fmu_cache, timing)
+      tic = time.perf_counter()
+      try:
+         fmu.reset()
+      except Exception:
+         # Instance left in an error state by a previous simulation - make a new one
+         fmu_free(fmu_cache)
+         fmu = fmu_instance_get(fmu_model, fmu_cache, timing)
+         tic = time.perf_counter()
+      fmu_cache['runs'] = fmu_cache['runs'] + 1
+      filename = fmu_cache['dir']
+      kwargs.update(model_description=model_description_get(), fmu_instance=fmu)
+      # Start values set in one call per type instead of one by one in simulate_fmu()
+      fmu_set_values(fmu, start_values)
+      start_values_fmu = {}
+      timing_add('instantiate', tic, timing=timing)
+      if not stop == []:
+         conditions = [stop_condition(condition) for condition in stop]
+         get = lambda name: fmu_value(fmu, name)
+         # FMPy ends the simulation before the sample of this step is recorded and it is therefore recorded here
+         def step_finished(time, recorder):
+            if any(condition(time, get) for condition in conditions):
+               recorder.sample(time, force=True)
+               return False
+            return True
+      # The instance is already made and FMI calls are logged by its attribute fmiCallLogger
+      fmu.fmiCallLogger = fmi_call_logger
+   else:
+      fmpy_simulation_import()
+      filename = fmu_model
+      start_values_fmu = start_values
+      if not stop == []: print('Error: Stop conditions need fmu_cached=True and are not used')
+
+   # The first step done marks the end of initialization
+   clock = {'initialized': None}
+   def step_timed(time_step, recorder):
+      if clock['initialized'] is None: clock['initialized'] = time.perf_counter()
+      if (cancel is not None) and cancel.is_set(): return False
+      return True if step_finished is None else step_finished(time_step, recorder)
+
+   fmiCallClock['last'] = None
+   tic = time.perf_counter()
+   try:
+      sim_res_local = simulate_fmu(
+         filename = filename,
+         validate = False,
+         start_time = start_time,
+         stop_time = stop_time,
+         output_interval = output_interval,
+         record_events = True,
+         start_values = start_values_fmu,
+         fmi_call_logger = fmi_call_logger,
+         output = output,
+         step_finished = step_timed,
+         **kwargs)
+   finally:
+      if fmu_cached: fmu.fmiCallLogger = None
+   toc = time.perf_counter()
+   if clock['initialized'] is None: clock['initialized'] = toc
+   timing_add('initialize', tic, clock['initialized'], timing)
+   timing_add('integrate', clock['initialized'], toc, timing)
+   if (cancel is not None) and cancel.is_set():
+      from concurrent.futures import CancelledError
+      raise CancelledError('simulation cancelled at time ' + str(sim_res_local['time'][-1]))
+
+   if key is not None: 
+      result_cache_put(key, sim_res_local)
+      timing_add('result', toc, timing=timing)
+   return sim_res_local
+
+def fmu_cache_info():
+   """ Print the one-time cost of extraction and instantiation that the cached backend saves per simu() call."""
+   extract_time = fmuCache['timing'].get('extract')
+   instantiate_time = fmuCache['timing'].get('instantiate')
+   print('FMU extracted to:', fmuCache['dir'])
+   if extract_time is None:
+      print(' -Extraction: reused from earlier session')
+   else:
+      print(' -Extraction:', np.round(1000*extract_time, 1), 'ms')
+   if instantiate_time is not None:
+      print(' -Instantiation:', np.round(1000*instantiate_time, 1), 'ms')
+      saved = (instantiate_time + (extract_time or 0))*max(fmuCache['runs'] - 1, 0)
+      print(' -Saved per simu() call at least:', np.round(1000*(instantiate_time + (extract_time or 0)), 1), 'ms')
+      print(' -Simulations with the same instance:', fmuCache['runs'])
+      print(' -Time saved in total at least:', np.round(saved, 3), 's')
+
+# Start values for simulation in mode 'cont' with parameters from parValue and initial values from stateValue
+def start_values_cont(parValue=parValue, parLocation=parLocation, stateValue=stateValue, \
+                      stateValueInitial=stateValueInitial, stateValueInitialLoc=stateValueInitialLoc):
+   """ Return start_values for continued simulation from the final state of the previous simulation.
+       Initial values of states in parValue are replaced by the final state in stateValue."""
+   start_values_local = {parLocation[k]:parValue[k] for k in parValue.keys()}
+   start_values_local.update({stateValueInitialLoc[stateValueInitial[key]]:stateValue[key] 
+                              for key in stateValueInitial.keys()})
+   return start_values_local
+
+# Schedule of parameter changes during a simulation given as list of (time, {parameter: value}) or, with
+# basis='volume', as list of (pumped volume ackF, {parameter: value}) on the same scale as the switch points.
+# All parameters of the FMU have variability fixed and cannot be changed during integration, and each segment 
+# is therefore simulated with the cached FMU instance reset() and continued from the state at the change
+def fmu_simulate_schedule(schedule, start_time, stop_time, basis='time', options=opts_std, output=None, \
+                          parValue=parValue, parLocation=parLocation, stateStart=None, stop=None, **kwargs):
+   """ Simulate from start_time to stop_time with the parameter changes in schedule applied in turn and 
+       return sim_res of all segments together and parValue after the last change made. With stateStart given
+       the simulation continues from these state values as in mode 'cont'. At each change the time is 
+       repeated in sim_res, as for events. Changes not reached before stop_time are not applied."""
+   if basis not in ['time', 'volume']: raise ValueError('Schedule basis not known: ' + str(basis))
+   for point, changes in schedule:
+      unknown = [key for key in changes.keys() if key not in parValue.keys()]
+      if not unknown == []:
+         raise KeyError(', '.join(unknown) + ' - seems not an accessible parameter - check the spelling')
+   if stop is None: stop = []
+   if (basis == 'volume') & (output is not None): output = list(set(output + ['ackF']))
+   entries = sorted(schedule, key=lambda entry: entry[0])
+   # Changes at or after stop_time would not take effect and are left out
+   if basis == 'time': entries = [entry for entry in entries if entry[0] < stop_time]
+   outputInterval = (stop_time - start_time)/options['NCP']
+   parValueLocal = parValue.copy()
+   segments = []
+   segmentStart = start_time
+   stateLocal = stateStart
+   for k in range(len(entries) + 1):
+      if stateLocal is None:
+         start_values_local = {parLocation[key]:parValueLocal[key] for key in parValueLocal.keys()}
+      else:
+         start_values_local = start_values_cont(parValueLocal, parLocation, stateLocal)
+      # Segment end by time, or by a stop condition on the pumped volume that flags when the volume is reached
+      segmentEnd = stop_time
+      segmentStop = stop
+      reached = {'volume': False}
+      if k < len(entries):
+         if basis == 'time': 
+            segmentEnd = min(max(entries[k][0], segmentStart), stop_time)
+         else:
+            def volume_reached(time, get, volume=entries[k][0], reached=reached):
+               reached['volume'] = get('ackF') >= volume
+               return reached['volume']
+            segmentStop = stop + [volume_reached]
+      optionsSegment = options.copy()
+      optionsSegment['NCP'] = max(int(round((segmentEnd - segmentStart)/outputInterval)), 1)
+      if segmentEnd > segmentStart:
+         segment = fmu_simulate(start_values_local, segmentStart, segmentEnd, options=optionsSegment, output=output,
+                                stop=segmentStop, **kwargs)
+         segments.append(segment)
+         segmentStart = float(segment['time'][-1])
+         stateLocal = {key: float(segment[key][-1]) for key in stateValueInitial.keys()}
+      # Ended by a stop condition of the user or at stop_time
+      if k == len(entries): break
+      if (basis == 'time') & (segmentStart < segmentEnd - 1e-9*(stop_time - start_time)): break
+      if (basis == 'volume') & (not reached['volume']): break
+      # Apply the change
+      parValueLocal.update(entries[k][1])
+      parErrors = par_check(parValueLocal)
+      if not parErrors == []:
+         raise ValueError('the following requirements do not hold: ' + ', '.join(parErrors))
+   return np.concatenate(segments), parValueLocal
+
+# Simulation session that owns its parameters, states, result and FMU instance. Sessions share the model 
+# description, modelIndex and the result cache and can run concurrently in threads of one process. 
+# The module functions par(), init(), simu(), model_get() and kpi() work on the default session below.
+class Session:
+   """ Simulation context with parValue, stateValue, sim_res, start_values and prevFinalTime of its own,
+       e.g. s = Session(); s.par(LFR=60); s.simu(600); s.model_get('tank_harvest.V')
+       Diagrams are not plotted by a session, use simu() of the default session for that.
+       Time of the phases of simu() is kept in last_timing and timingProfile of the session, see timing_info()."""
+
+   def __init__(self, parValue=None, stateValue=None, fmu_cache=None, last_timing=None, timingProfile=None):
+      if parValue is None: parValue = parValueDefault.copy()
+      if stateValue is None:
+         stateValue = {name:None for name in modelMeta['states']}
+         stateValue.update(timeDiscreteStates)
+      if fmu_cache is None: 
+         fmu_cache = {'dir': None, 'instance': None, 'runs': 0, 'timing': {}}
+         weakref.finalize(self, fmu_free, fmu_cache)
+      self.parValue = parValue
+      self.stateValue = stateValue
+      self.fmuCache = fmu_cache
+      self.sim_res = None
+      self.start_values = {}
+      self.prevFinalTime = 0
+      self.last_timing = {} if last_timing is None else last_timing
+      self.timingProfile = {'enabled': True, 'simu': 0, 'phases': {}} if timingProfile is None else timingProfile
+
+   def par(self, *x, **x_kwarg):
+      """ Set parameter values of the session, see par()."""
+      par(*x, parValue=self.parValue, **x_kwarg)
+
+   def init(self, *x, **x_kwarg):
+      """ Set initial values of the session, see init()."""
+      init(*x, parValue=self.parValue, **x_kwarg)
+
+   def simu(self, simulationTime=simulationTime, mode='Initial', options=opts_std, output=None, stop=None, \
+            schedule=None, schedule_basis='time', fmu_cached=True, fmi_call_logger=None, \
+            parValue=None, stateValue=None, parLocation=parLocation, fmu_model=fmu_model, fmu_cache=None, \
+            cancel=None):
+      """ Simulate as simu() with the parameters and states of the session, without plotting.
+          Output is keyVariables if not given and the states are always added. Return True when a simulation
+          is done.
+          The FMU instance of the session is used unless fmu_cache is given, and cancel is a threading.Event
+          that ends the simulation, see fmu_simulate()."""
+      if fmu_cache is None: fmu_cache = self.fmuCache
+      if parValue is None: parValue = self.parValue
+      if stateValue is None: stateValue = self.stateValue
+      if output is None: output = keyVariables
+      output = list(set(list(output) + list(stateValue.keys())))
+      self.last_timing.clear()
+      self.timingProfile['simu'] = self.timingProfile['simu'] + 1
+      if mode in ['Initial', 'initial', 'init']:
+         start_time = 0
+         stateStart = None
+         start_values_local = {parLocation[k]:parValue[k] for k in parValue.keys()}
+      elif mode in ['Continued', 'continued', 'cont']:
+         if self.prevFinalTime == 0:
+            print("Error: Simulation is first done with default mode = init'")
+            return False
+         start_time = self.prevFinalTime
+         stateStart = stateValue
+         start_values_local = start_values_cont(parValue, parLocation, stateValue)
+      else:
+         print("Error: Simulation mode not correct")
+         return False
+
+      if schedule is None:
+         sim_res_local = fmu_simulate(start_values_local, start_time, start_time + simulationTime, options=options,
+            fmu_model=fmu_model, output=output, fmu_cached=fmu_cached, stop=stop, 
+            fmi_call_logger=fmi_call_logger, fmu_cache=fmu_cache, cancel=cancel, timing=self)
+      else:
+         sim_res_local, parValueSchedule = fmu_simulate_schedule(schedule, start_time, start_time + simulationTime, 
+            basis=schedule_basis, options=options, output=output, parValue=parValue, parLocation=parLocation, 
+            stateStart=stateStart, stop=stop, fmu_model=fmu_model, fmu_cached=fmu_cached, 
+            fmi_call_logger=fmi_call_logger, fmu_cache=fmu_cache, cancel=cancel, timing=self)
+         parValue.update(parValueSchedule)
+      self.sim_res = sim_res_local
+      self.start_values = start_values_local
+
+      # Store final state values in stateValue and time from where simulation will start next time
+      tic = time.perf_counter()
+      for key in stateValue.keys(): 
+         stateValue[key] = model_get(key, sim_res_local=sim_res_local, start_values_local=start_values_local)
+      timing_add('state', tic, timing=self)
+      self.prevFinalTime = sim_res_local['time'][-1]
+      return True
+
+   def model_get(self, parLoc):
+      """ Return value of parLoc from the result of the session, see model_get()."""
+      return model_get(parLoc, sim_res_local=self.sim_res, start_values_local=self.start_values)
+
+   def kpi(self):
+      """ Return key performance indicators of the last simulation of the session, see kpi()."""
+      return kpi(self.sim_res)
+
+   def close(self):
+      """ Free the FMU instance of the session."""
+      if self.fmuCache is not fmuCache: fmu_free(self.fmuCache)
+
+# Default session that works on parValue, stateValue, fmuCache, last_timing and timingProfile of the module
+session = Session(parValue, stateValue, fmu_cache=fmuCache, last_timing=last_timing, timingProfile=timingProfile)
 
 # Define simulation
 def simu(simulationTime=simulationTime, mode='Initial', options=opts_std, diagrams=diagrams, fmu_model=fmu_model, \
          stateValue=stateValue, stateValueInitial=stateValueInitial, stateValueInitialLoc=stateValueInitialLoc, \
          timeDiscreteStates=timeDiscreteStates, \
-         keyVariables=keyVariables, parValue=parValue, parLocation=parLocation):
-   """Model loaded and given intial values and parameter before, and plot window also setup before."""   
+         keyVariables=keyVariables, parValue=parValue, parLocation=parLocation, fmu_cached=True, stop=None, \
+         fmi_call_logger=None, plot=True, schedule=None, schedule_basis='time'):
+   """Model loaded and given intial values and parameter before, and plot window also setup before.
+      With fmu_cached=True the FMU is extracted and instantiated once and reused, see fmu_cache_info().
+      The simulation ends before simulationTime when any stop condition holds, e.g. stop=[('pooling_done',)],
+      see stop_condition(). Time of each phase is kept in last_timing, see timing_info(), and with 
+      fmi_call_logger=fmi_call_logger the FMI calls are counted, see fmi_call_info().
+      With plot=False, or in headless mode, diagrams are not evaluated but sim_res is the same.
+      Parameters are changed during the simulation by schedule=[(time, {parameter: value}), ...] or with
+      schedule_basis='volume' at pumped volumes, see fmu_simulate_schedule(), and parValue is updated.
+      The simulation is done by the default session, see Session."""   
    
    # Global variables
    global sim_res, prevFinalTime, start_values
-   
-   # Simulation flag
-   simulationDone = False
-   
-   # Internal help function to extract variables to be stored
-   def extract_variables(diagrams):
-       output = []
-       variables = [v for v in model_description.modelVariables if v.causality == 'local']
-       for j in range(len(diagrams)):
-           for k in range(len(variables)):
-               if variables[k].name in diagrams[j]:
-                   output.append(variables[k].name)
-       return output
-
-   # Run simulation
-   if mode in ['Initial', 'initial', 'init']: 
-      
-      start_values = {parLocation[k]:parValue[k] for k in parValue.keys()}
-      
-      # Simulate
-      sim_res = simulate_fmu(
-         filename = fmu_model,
-         validate = False,
-         start_time = 0,
-         stop_time = simulationTime,
-         output_interval = simulationTime/options['NCP'],
-         record_events = True,
-         start_values = start_values,
-         fmi_call_logger = None,
-         output = list(set(extract_variables(diagrams) + list(stateValue.keys()) + keyVariables))
-      )
+
+   # Run simulation - prevFinalTime may also be set by simu_stream()
+   session.prevFinalTime = prevFinalTime
+   simulationDone = session.simu(simulationTime, mode, options=options, fmu_model=fmu_model,
+      output = list(set(extract_variables(diagrams) + list(stateValue.keys()) + keyVariables)),
+      fmu_cached = fmu_cached, stop = stop, fmi_call_logger = fmi_call_logger, schedule = schedule, 
+      schedule_basis = schedule_basis, parValue = parValue, stateValue = stateValue, parLocation = parLocation)
+
+   if simulationDone:
+      sim_res = session.sim_res
+      start_values = session.start_values
+      prevFinalTime = session.prevFinalTime
       
-      simulationDone = True
+      # Plot diagrams from simulation
+      if plot & (not plotSetup['headless']):
+         tic = time.perf_counter()
+         linetype = next(linecycler)    
+         diagram_plot(diagrams, linetype)
+         timing_add('plot', tic, timing=session)
       
+   else:
+      print('Error: No simulation done')
+            
+# Streaming simulation - the FMU is integrated once in a thread and at each block end step_finished() hands over
+# the samples recorded so far, which are yielded while the integration goes on. A Model Exchange FMU cannot be 
+# continued by a new simulate_fmu() call without initialization, and therefore the integration is not split up
+def simu_stream(simulationTime=simulationTime, blocks=10, mode='Initial', options=opts_std, output=None, \
+                diagrams=diagrams, keyVariables=keyVariables, stateValue=stateValue, \
+                parValue=parValue, parLocation=parLocation):
+   """ Simulate as simu() but yield the result in blocks of samples during the integration, 
+       e.g. for block in simu_stream(600, blocks=60): print(block['time'][-1], block['tank_harvest.V'][-1])
+       Each block is a structured array like sim_res and at most two blocks are kept in memory.
+       No diagrams are plotted and sim_res is not changed, but stateValue and prevFinalTime are updated
+       when the last block is done so that simu(mode='cont') can follow. If the loop is left early
+       the integration is stopped. Do not call simu() until the loop is done, since the same FMU instance 
+       is used, see stream_check()."""   
+   global prevFinalTime
+
+   if mode in ['Initial', 'initial', 'init']:
+      start_time = 0
+      start_values_local = {parLocation[k]:parValue[k] for k in parValue.keys()}
    elif mode in ['Continued', 'continued', 'cont']:
-      
-      if prevFinalTime == 0: 
+      if prevFinalTime == 0:
          print("Error: Simulation is first done with default mode = init'")
-         
-      else:         
-         # Update parValueMod and create parLocationMod
-         parValueRed = parValue.copy()
-         parLocationRed = parLocation.copy()
-         for key in parValue.keys():
-            if parLocation[key] in stateValueInitial.values(): 
-               del parValueRed[key]  
-               del parLocationRed[key]
-         parLocationMod = dict(list(parLocationRed.items()) + list(stateValueInitialLoc.items()))
+         return
+      start_time = prevFinalTime
+      start_values_local = start_values_cont(parValue, parLocation, stateValue)
+   else:
+      print("Error: Simulation mode not correct")
+      return
+   if output is None:
+      output = list(set(extract_variables(diagrams) + list(stateValue.keys()) + keyVariables))
    
-         # Create parValueMod and parLocationMod
-         parValueMod = dict(list(parValueRed.items()) + 
-            [(stateValueInitial[key], stateValue[key]) for key in stateValue.keys()])      
-
-         start_values = {parLocationMod[k]:parValueMod[k] for k in parValueMod.keys()}
-  
-         # Simulate
-         sim_res = simulate_fmu(
-            filename = fmu_model,
+   fmu = fmu_instance_get()
+   fmu.reset()
+   fmu_set_values(fmu, start_values_local)
+   fmuCache['runs'] = fmuCache['runs'] + 1
+   blockTime = simulationTime/blocks
+   blockQueue = queue.Queue(maxsize=1)
+   closed = threading.Event()
+   handed = {'blocks': 0}
+
+   # Internal help functions - hand over to the generator, and give up if the generator is closed
+   def handover(item):
+      while not closed.is_set():
+         try:
+            blockQueue.put(item, timeout=0.1)
+            return True
+         except queue.Full:
+            pass
+      return False
+
+   # The samples after the last block end are the last block and come from the result of simulate_fmu()
+   def step_finished(time_step, recorder):
+      if (handed['blocks'] < blocks - 1) \
+         & (time_step >= start_time + (handed['blocks'] + 1)*blockTime - 1e-9*simulationTime):
+         while (handed['blocks'] < blocks - 1) \
+               & (time_step >= start_time + (handed['blocks'] + 1)*blockTime - 1e-9*simulationTime):
+            handed['blocks'] = handed['blocks'] + 1
+         block = np.array(recorder.rows, dtype=np.dtype(recorder.cols))
+         recorder.rows.clear()
+         return handover(('block', block))
+      return not closed.is_set()
+
+   def integrate():
+      try:
+         block = simulate_fmu(
+            filename = fmuCache['dir'],
             validate = False,
-            start_time = prevFinalTime,
-            stop_time = prevFinalTime + simulationTime,
+            start_time = start_time,
+            stop_time = start_time + simulationTime,
             output_interval = simulationTime/options['NCP'],
             record_events = True,
-            start_values = start_values,
-            fmi_call_logger = None,
-            output = list(set(extract_variables(diagrams) + list(stateValue.keys()) + keyVariables))
-         )
-      
-         simulationDone = True
+            start_values = {},
+            output = output,
+            model_description = model_description_get(),
+            fmu_instance = fmu,
+            step_finished = step_finished)
+         handover(('block', np.asarray(block))) and handover(('done', None))
+      except Exception as error:
+         handover(('error', error))
+
+   thread = threading.Thread(target=integrate, daemon=True)
+   thread.start()
+   try:
+      last = None
+      while True:
+         kind, block = blockQueue.get()
+         if kind == 'error': raise block
+         if kind == 'done': break
+         if len(block) > 0:
+            last = block
+            yield block
+
+      # Store final state values in stateValue and time from where simulation will start next time
+      for key in stateValue.keys(): 
+         if key in last.dtype.names: stateValue[key] = float(last[key][-1])
+      prevFinalTime = last['time'][-1]
+   finally:
+      closed.set()
+      thread.join()
+
+def stream_check(simulationTime=simulationTime, blocks=4, decimals=6):
+   """ Compare simu_stream() in blocks with simu() for present parValue, and print number of blocks, samples 
+       and largest difference of the states at the end. Return True if they agree."""
+   stream = list(simu_stream(simulationTime, blocks=blocks))
+   simu(simulationTime, plot=False)
+   stream_res = np.concatenate(stream)
+   difference = max(abs(float(stream_res[key][-1]) - float(sim_res[key][-1])) for key in stateValueInitial.keys())
+   print('Blocks:', len(stream), ' samples stream:', len(stream_res), ' simu:', len(sim_res), 
+         ' largest difference of final states:', np.round(difference, decimals))
+   return (len(stream) == blocks) & (len(stream_res) == len(sim_res)) & (difference < 10**(-decimals))
+
+# Parameter sweep - scenarios run headless in a process pool with one FMU instance per worker process
+def sweep_worker_init():
+   """ Initialize a worker process of simu_sweep() with its own FMU instance."""
+   # The instance inherited from the parent process is not used by the worker
+   fmuCache['instance'] = None
+   fmuCache['runs'] = 0
+   fmu_instance_get()
+
+def sweep_scenario(scenario, simulationTime=simulationTime, options=opts_std, output=None, stop=None, \
+                   parValue=parValue, parLocation=parLocation, stateValue=stateValue, start_time=0, stateStart=None, \
+                   fmu_cache=None, cancel=None):
+   """ Simulate one scenario of simu_sweep(), i.e. a dictionary of parValue updates, and return a result
+       dictionary with keys: scenario, parValue, sim_res, stateValue and error.
+       With stateStart given the simulation continues from start_time with these state values as in mode 'cont'.
+       The FMU instance in fmu_cache is used, default fmuCache, and cancel is passed to fmu_simulate()."""
+   from concurrent.futures import CancelledError
+   result = {'scenario': scenario, 'parValue': None, 'sim_res': None, 'stateValue': None, 'error': None}
+   try:
+      unknown = [key for key in scenario.keys() if key not in parValue.keys()]
+      if not unknown == []:
+         raise KeyError(', '.join(unknown) + ' - seems not an accessible parameter - check the spelling')
+      parValueLocal = parValue.copy()
+      parValueLocal.update(scenario)
+      parErrors = par_check(parValueLocal)
+      if not parErrors == []:
+         raise ValueError('the following requirements do not hold: ' + ', '.join(parErrors))
+      if stateStart is None:
+         start_values_local = {parLocation[k]:parValueLocal[k] for k in parValueLocal.keys()}
+      else:
+         start_values_local = start_values_cont(parValueLocal, parLocation, stateStart)
+      sim_res_local = fmu_simulate(start_values_local, start_time, simulationTime, options=options, output=output, 
+                                   stop=stop, fmu_cache=fmu_cache, cancel=cancel)
+      result['parValue'] = parValueLocal
+      result['sim_res'] = sim_res_local
+      result['stateValue'] = {key: float(sim_res_local[key][-1]) for key in stateValue.keys()}
+   except (Exception, CancelledError) as error:
+      result['error'] = repr(error)
+   return result
+
+def sweep_scenario_pooled(scenario, *args, **kwargs):
+   """ Simulate one scenario as sweep_scenario() with an FMU instance taken from fmuPool, for threads."""
+   fmu_cache = fmu_pool_acquire()
+   try:
+      return sweep_scenario(scenario, *args, fmu_cache=fmu_cache, **kwargs)
+   finally:
+      fmu_pool_release(fmu_cache)
+
+def simu_sweep(scenarios, simulationTime=simulationTime, workers=None, options=opts_std, diagrams=diagrams, \
+               keyVariables=keyVariables, stateValue=stateValue, store=None, stop=None, share_prefix=False, \
+               pool='process'):
+   """ Simulate a list, or generator, of scenarios where each scenario is a dictionary of parValue updates 
+       relative the present parValue, e.g. simu_sweep([{'k1': 0.2}, {'k1': 0.3}], workers=4).
+       Scenarios are checked as by par() and run headless in a process pool with one FMU per worker.
+       Return a list of result dictionaries in the order of the scenarios, see sweep_scenario().
+       Failed scenarios have the error given in result['error'] and the other results are not affected.
+       With store given as a directory each successful run is also written to the result store.
+       Stop conditions are given as tuples, see stop_condition(), and apply to each scenario.
+       With share_prefix=True scenarios that differ only in parameters that take effect later share the 
+       simulation up to that point, see sweep_shared(). The scenarios are then read into a list first.
+       With pool='thread' the scenarios run in a thread pool with FMU instances from fmuPool instead, which 
+       avoid the start of worker processes and pickling of results and may be cheaper for short runs."""
+   import multiprocessing
+   from concurrent.futures import ProcessPoolExecutor
+   from concurrent.futures import ThreadPoolExecutor
+   if workers is None: workers = os.cpu_count()
+   output = list(set(extract_variables(diagrams) + list(stateValue.keys()) + keyVariables))
+   if store is not None: output = list(set(output + storeSignals))
+   if share_prefix:
+      scenarios = list(scenarios)
+      output = list(set(output + [scaling for switch, scaling in parEffect.values() if scaling in modelIndex]))
+   results = []
+
+   # Internal help function to collect results and write successful ones to the result store
+   def collect(result):
+      if (store is not None) and (result['error'] is None):
+         result['run'] = result_store_write(store, result['sim_res'], result['parValue'])
+      results.append(result)
+
+   if pool not in ['process', 'thread']: raise ValueError('Pool not known: ' + str(pool))
+   task = sweep_scenario
+   if pool == 'thread': task = sweep_scenario_pooled
+
+   if (workers > 1) & ((pool == 'thread') | ('fork' in multiprocessing.get_all_start_methods())):
+      if pool == 'thread':
+         executor = ThreadPoolExecutor(max_workers=workers)
+      else:
+         executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'), 
+                                        initializer=sweep_worker_init)
+      with executor:
+         if share_prefix:
+            for result in sweep_shared(scenarios, simulationTime, options, output, stop, executor, task=task):
+               collect(result)
+         else:
+            # Limit the number of scenarios in flight so that generators are consumed gradually
+            pending = deque()
+            for scenario in scenarios:
+               pending.append((scenario, executor.submit(task, scenario, simulationTime, options, output, stop)))
+               if len(pending) >= 4*workers:
+                  collect(sweep_result(*pending.popleft()))
+            while pending:
+               collect(sweep_result(*pending.popleft()))
    else:
-      
-      print("Error: Simulation mode not correct")
+      if workers > 1: print('Process pool not available on this platform - scenarios run one by one')
+      if share_prefix:
+         for result in sweep_shared(scenarios, simulationTime, options, output, stop):
+            collect(result)
+      else:
+         for scenario in scenarios:
+            collect(sweep_scenario(scenario, simulationTime, options, output, stop))
+
+   return results
+
+def sweep_result(scenario, future):
+   """ Return the result of a future from simu_sweep() also when the worker process failed."""
+   try:
+      return future.result()
+   except Exception as error:
+      return {'scenario': scenario, 'parValue': None, 'sim_res': None, 'stateValue': None, 'error': repr(error)}
+
+# Prefix sharing - scenarios equal in all parameters that take effect from time 0 form a group. The first
+# scenario of a group is simulated from time 0 and the others continue from its state at the last output time 
+# before the first switch point where the scenarios differ, see parEffect
+def sweep_plan(scenarios, parValue=parValue):
+   """ Return list of groups of scenario indices that can share the start of the simulation."""
+   groups = OrderedDict()
+   for k, scenario in enumerate(scenarios):
+      key = repr(sorted((name, value) for name, value in scenario.items() if name not in parEffect.keys()))
+      if key not in groups: groups[key] = []
+      groups[key].append(k)
+   return list(groups.values())
+
+def sweep_effect_time(scenarios, sim_res_local, parValue=parValue):
+   """ Return the first time where any of the scenarios differ, from the switch points in parEffect.
+       The scaling of the switch points is taken from sim_res_local. Identical scenarios give inf."""
+   effectTime = np.inf
+   for name in set().union(*[scenario.keys() for scenario in scenarios]):
+      values = [scenario.get(name, parValue.get(name)) for scenario in scenarios]
+      if all(value == values[0] for value in values): continue
+      if name not in parEffect.keys(): return 0
+      switch, scaling = parEffect[name]
+      switchTime = min(scenario.get(switch, parValue[switch]) for scenario in scenarios)/sim_res_local[scaling][0]
+      effectTime = min(effectTime, switchTime)
+   return effectTime
+
+def sweep_fork_point(scenarios, reference, simulationTime=simulationTime, options=opts_std):
+   """ Return (row in the reference result, output step) to continue the other scenarios of a group from,
+       or None if the group shares no part of the simulation."""
+   if reference['error'] is not None: return None
+   sim_res_local = reference['sim_res']
+   effectTime = sweep_effect_time(scenarios, sim_res_local)
+   outputInterval = simulationTime/options['NCP']
+   # The last output time before the effect, and at least one step before the end
+   forkStep = min(int(np.ceil(effectTime/outputInterval)) - 1 if np.isfinite(effectTime) else options['NCP'], 
+                  options['NCP'] - 1)
+   if forkStep < 1: return None
+   rows = np.nonzero(np.abs(sim_res_local['time'] - forkStep*outputInterval) <= 1e-9*simulationTime)[0]
+   if len(rows) == 0: return None
+   # After an event at the same time the last row holds the state after the event
+   return rows[-1], forkStep
+
+def sweep_shared(scenarios, simulationTime=simulationTime, options=opts_std, output=None, stop=None, \
+                 executor=None, stateValue=stateValue, task=sweep_scenario):
+   """ Simulate a list of scenarios for simu_sweep(share_prefix=True) in the executor, or one by one if None.
+       For each group from sweep_plan() the first scenario is simulated from time 0 and the others continue
+       from its state with the start values of mode 'cont', see sweep_fork_point(). The result of those 
+       starts with the rows of the first scenario up to the fork and result['fork_time'] gives that time.
+       Note that parameters logged in sim_res have the values of the first scenario in these rows.
+       Each scenario is simulated by task, sweep_scenario() or sweep_scenario_pooled() for threads."""
+   from concurrent.futures import Future
+
+   # Internal help function to run a task in the executor or directly
+   def submit(function, *args, **kwargs):
+      if executor is not None: return executor.submit(function, *args, **kwargs)
+      future = Future()
+      future.set_result(function(*args, **kwargs))
+      return future
+
+   groups = sweep_plan(scenarios)
+   references = [(group, submit(task, scenarios[group[0]], simulationTime, options, output, stop)) 
+                 for group in groups]
+   results = [None]*len(scenarios)
+   pending = []
+   for group, future in references:
+      reference = sweep_result(scenarios[group[0]], future)
+      results[group[0]] = reference
+      fork = None
+      if len(group) > 1: fork = sweep_fork_point([scenarios[k] for k in group], reference, simulationTime, options)
+      for k in group[1:]:
+         if fork is None:
+            pending.append((k, None, None, submit(task, scenarios[k], simulationTime, options, output, stop)))
+         else:
+            forkRow, forkStep = fork
+            stateStart = {key: float(reference['sim_res'][key][forkRow]) for key in stateValue.keys()}
+            optionsFork = options.copy()
+            optionsFork['NCP'] = options['NCP'] - forkStep
+            pending.append((k, reference, forkRow, 
+                            submit(task, scenarios[k], simulationTime, optionsFork, output, stop, 
+                                   start_time=float(reference['sim_res']['time'][forkRow]), stateStart=stateStart)))
+   for k, reference, forkRow, future in pending:
+      result = sweep_result(scenarios[k], future)
+      if (reference is not None) and (result['error'] is None):
+         result['sim_res'] = np.concatenate((reference['sim_res'][:forkRow+1], result['sim_res'][1:]))
+         result['fork_time'] = float(reference['sim_res']['time'][forkRow])
+      results[k] = result
+   return results
+
+# asyncio API - simulations run in an executor, default the thread pool of the event loop, so that the loop is
+# not blocked. When the awaiting task is cancelled, or the timeout is passed, the simulation is told to end at 
+# its next output step through a threading.Event, see fmu_simulate(). Simulations queued in the executor are
+# held back by an asyncio.Semaphore the size of the executor, so that the timeout starts when a worker is free
+def executor_workers(executor=None):
+   """ Return the number of workers of executor, or of the default thread pool of the event loop if None."""
+   workers = getattr(executor, '_max_workers', None)
+   if workers is None: workers = min(32, (os.cpu_count() or 1) + 4)
+   return workers
+
+async def executor_run(function, *args, timeout=None, executor=None, limit=None, **kwargs):
+   """ Await function(*args, cancel=event, **kwargs) run in executor and set the event if cancelled or 
+       timeout in seconds is passed, then asyncio.CancelledError or asyncio.TimeoutError is raised.
+       With limit given as an asyncio.Semaphore it is acquired first and the timeout starts after that. 
+       It is released when function has returned, also after a timeout, since the worker is busy until then.
+       The exception of a simulation ended after timeout or cancel is not awaited and is taken here."""
+
+   # Internal help function called when function has returned
+   def finished(done):
+      if not done.cancelled(): done.exception()
+      if limit is not None: limit.release()
+
+   import asyncio
+   if limit is not None: await limit.acquire()
+   cancel = threading.Event()
+   loop = asyncio.get_running_loop()
+   try:
+      future = loop.run_in_executor(executor, functools.partial(function, *args, cancel=cancel, **kwargs))
+   except BaseException:
+      if limit is not None: limit.release()
+      raise
+   future.add_done_callback(finished)
+   try:
+      # Shielded so that the future is done only when function has returned
+      return await asyncio.wait_for(asyncio.shield(future), timeout)
+   except (asyncio.CancelledError, asyncio.TimeoutError):
+      cancel.set()
+      raise
+
+def simu_async_run(session, simulationTime, mode, cancel=None, **kwargs):
+   """ Simulate with session.simu() and an FMU instance from fmuPool, for simu_async()."""
+   fmu_cache = fmu_pool_acquire()
+   try:
+      if not session.simu(simulationTime, mode, fmu_cache=fmu_cache, cancel=cancel, **kwargs):
+         raise ValueError('No simulation done in mode ' + str(mode))
+   finally:
+      fmu_pool_release(fmu_cache)
+   return session
+
+async def simu_async(simulationTime=simulationTime, mode='Initial', session=None, timeout=None, executor=None, \
+                     limit=None, **kwargs):
+   """ Simulate as Session.simu() without blocking the event loop and return the session with the result,
+       e.g. s = await simu_async(600, timeout=60); s.kpi()
+       With session=None a new Session is made from the present parValue. Other keyword arguments are given to 
+       Session.simu(). The FMU instance is taken from fmuPool, and a session should only run one simulation 
+       at a time. Raise asyncio.TimeoutError when timeout in seconds is passed. When many simulations are
+       awaited together, give them one limit = asyncio.Semaphore(executor_workers(executor)) so that the 
+       timeout starts when the simulation starts, see executor_run()."""
+   if session is None: session = Session(parValue.copy())
+   return await executor_run(simu_async_run, session, simulationTime, mode, timeout=timeout, executor=executor, 
+                             limit=limit, **kwargs)
+
+async def simu_sweep_async(scenarios, simulationTime=simulationTime, options=opts_std, diagrams=diagrams, \
+                           keyVariables=keyVariables, stateValue=stateValue, stop=None, timeout=None, executor=None):
+   """ Simulate a list of scenarios as simu_sweep(pool='thread') without blocking the event loop and return
+       the list of result dictionaries, see sweep_scenario(). A scenario that does not finish within timeout 
+       in seconds from its start is ended and has the error given in result['error'], and the other results 
+       are not affected. Scenarios wait for a free worker of executor before they start."""
+   import asyncio
+   output = list(set(extract_variables(diagrams) + list(stateValue.keys()) + keyVariables))
+   limit = asyncio.Semaphore(executor_workers(executor))
+
+   # Internal help function to simulate one scenario and turn a timeout into a failed result
+   async def run(scenario):
+      try:
+         return await executor_run(sweep_scenario_pooled, scenario, simulationTime, options, output, stop,
+                                   timeout=timeout, executor=executor, limit=limit)
+      except asyncio.TimeoutError as error:
+         return {'scenario': scenario, 'parValue': None, 'sim_res': None, 'stateValue': None, 'error': repr(error)}
+
+   return list(await asyncio.gather(*[run(scenario) for scenario in scenarios]))
+
+# Result store - each run is kept on disk as one npy-file per signal together with its parValue
+# in an index file, and signals are read back memory-mapped so that large studies can be sliced by run and signal
+storeSignals = ['time', 'ackF', 'uv_detector.value', 'conductivity_detector.value', 'control_pooling.out'] \
+               + [name for name in modelIndex.keys() if re.fullmatch(r'column\.outlet\.c\[\d+\]', name)] \
+               + [name for name in modelIndex.keys() if re.fullmatch(r'tank_\w+\.(m\[\d+\]|V)', name) \
+                  and modelIndex[name]['causality'] == 'local']
+
+# Run numbers are allocated by os.mkdir() of the run directory, which fails if another writer, also in 
+# another process, took the number. The next number to try is kept for each store in resultStoreNext
+resultStoreNext = {}
+resultStoreLock = threading.Lock()
+
+def result_store_allocate(store):
+   """ Create the directory of a new run in the result store and return the run number."""
+   key = os.path.abspath(store)
+   with resultStoreLock:
+      if key not in resultStoreNext:
+         runs = [int(entry.name[4:]) for entry in os.scandir(store) 
+                 if entry.is_dir() and re.fullmatch(r'run_\d+', entry.name)]
+         resultStoreNext[key] = max(runs, default=-1) + 1
+      run = resultStoreNext[key]
+      while True:
+         try:
+            os.mkdir(os.path.join(store, 'run_' + str(run).zfill(6)))
+            break
+         except FileExistsError:
+            run = run + 1
+      resultStoreNext[key] = run + 1
+   return run
+
+def result_store_write(store, sim_res_local=None, parValue=parValue, tag=None, signals=storeSignals):
+   """ Write signals of a simulation result and its parValue as a new run in the result store directory.
+       Signals not logged in the result are skipped. Return the run number."""
+   if sim_res_local is None: sim_res_local = sim_res
+   os.makedirs(store, exist_ok=True)
+   run = result_store_allocate(store)
+   rundir = os.path.join(store, 'run_' + str(run).zfill(6))
+   written = []
+   for signal in signals:
+      if signal in sim_res_local.dtype.names:
+         np.save(os.path.join(rundir, signal + '.npy'), np.ascontiguousarray(sim_res_local[signal]))
+         written.append(signal)
+   record = {'run': run, 'samples': len(sim_res_local), 'signals': written, 'tag': tag,
+             'parValue': {key: value.item() if isinstance(value, np.generic) else value 
+                          for key, value in parValue.items()}}
+   # One write of the whole line so that records of writers in other processes are not mixed
+   fd = os.open(os.path.join(store, 'index.jsonl'), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+   try:
+      os.write(fd, (json.dumps(record) + '\n').encode())
+   finally:
+      os.close(fd)
+   return run
+
+def result_store_index(store):
+   """ Return the list of run records in the result store, each with run, samples, signals, tag and parValue."""
+   try:
+      with open(os.path.join(store, 'index.jsonl')) as f:
+         return [json.loads(line) for line in f if line.strip()]
+   except FileNotFoundError:
+      return []
+
+def result_store_run(store, run):
+   """ Return a dictionary of memory-mapped signals of one run in the result store."""
+   rundir = os.path.join(store, 'run_' + str(run).zfill(6))
+   return {entry.name[:-4]: np.load(entry.path, mmap_mode='r') 
+           for entry in os.scandir(rundir) if entry.name.endswith('.npy')}
+
+def result_store_signal(store, signal, runs=None):
+   """ Return a list of one memory-mapped signal for the given runs, default all runs, in the result store."""
+   if runs is None: runs = [record['run'] for record in result_store_index(store)]
+   return [np.load(os.path.join(store, 'run_' + str(run).zfill(6), signal + '.npy'), mmap_mode='r') 
+           for run in runs]
 
-   if simulationDone:
-      
-      # Plot diagrams from simulation
-      linetype = next(linecycler)    
-      for command in diagrams: eval(command)
-   
-      # Store final state values in stateValue:        
-      for key in stateValue.keys(): stateValue[key] = model_get(key)  
-         
-      # Store time from where simulation will start next time
-      prevFinalTime = sim_res['time'][-1]
-      
-   else:
-      print('Error: No simulation done')
-            
 # Describe model parts of the combined system
 def describe_parts(component_list=[]):
    """List all parts of the model""" 
-       
-   def model_component(variable_name):
-      i = 0
-      name = ''
-      finished = False
-      if not variable_name[0] == '_':
-         while not finished:
-            name = name + variable_name[i]
-            if i == len(variable_name)-1:
-                finished = True 
-            elif variable_name[i+1] in ['.', '(']: 
-                finished = True
-            else: 
-                i=i+1
-      if name in ['der', 'temp_1', 'temp_2', 'temp_3', 'temp_4', 'temp_5', 'temp_6', 'temp_7']: name = ''
-      return name
-    
-#   variables = list(model.get_model_variables().keys())
-   variables = [v.name for v in model_description.modelVariables]
         
-   for i in range(len(variables)):
-      component = model_component(variables[i])
+   for component in modelMeta['components']:
       if (component not in component_list) \
       & (component not in ['','BPL', 'Customer', 'today[1]', 'today[2]', 'today[3]', 'temp_2', 'temp_3']):
          component_list.append(component)
@@ -1366,7 +2939,7 @@ def describe_general(name, decimals, parLocation=parLocation):
       print(description,'[',unit,']')
 
    elif name == 'process':
-      print(read_model_description(fmu_model).description)   
+      print(modelMeta['description'])   
       
    elif name in parLocation.keys():
       description = model_get_variable_description(parLocation[name])
@@ -1405,6 +2978,10 @@ def process_diagram(fmu_model=fmu_model, fmu_process_diagram=fmu_process_diagram
    except KeyError:
        print('No processDiagram.png file in the FMU, but try the file on disk.')
        processDiagram = fmu_process_diagram
+   if plotSetup['headless']:
+      print('Headless mode - no process diagram shown')
+      return
+   matplotlib_import()
    try:
        plt.imshow(img.imread(processDiagram))
        plt.axis('off')
@@ -1419,6 +2996,8 @@ def BPL_info():
    print(' - par()       - change of parameters and initial values')
    print(' - init()      - change initial values only')
    print(' - simu()      - simulate and plot')
+   print(' - simu_sweep() - simulate many parameter scenarios in parallel without plots')
+   print(' - simu_stream() - simulate and get the result block by block during the simulation')
    print(' - newplot()   - make a new plot')
    print(' - show()      - show plot from previous simulation')
    print(' - disp()      - display parameters and initial values from the last simulation')
@@ -1433,8 +3012,6 @@ def BPL_info():
 def system_info():
    """Print system information"""
 #   FMU_type = model.__class__.__name__
-   constants = [v for v in model_description.modelVariables if v.causality == 'local']
-   
    print()
    print('System information')
    print(' -OS:', platform.system())
@@ -1445,14 +3022,14 @@ def system_info():
    except NameError:
        print(' -Scipy: not installed in the notebook')
    print(' -FMPy:', version('fmpy'))
-   print(' -FMU by:', read_model_description(fmu_model).generationTool)
-   print(' -FMI:', read_model_description(fmu_model).fmiVersion)
-   if model_description.modelExchange is None:
+   print(' -FMU by:', modelMeta['generationTool'])
+   print(' -FMI:', modelMeta['fmiVersion'])
+   if not modelMeta['modelExchange']:
       print(' -Type: CS')
    else:
       print(' -Type: ME')
-   print(' -Name:', read_model_description(fmu_model).modelName)
-   print(' -Generated:', read_model_description(fmu_model).generationDateAndTime)
+   print(' -Name:', modelMeta['modelName'])
+   print(' -Generated:', modelMeta['generationDateAndTime'])
    print(' -MSL:', MSL_version)    
    print(' -Description:', BPL_version)   
    print(' -Interaction:', FMU_explore)
@@ -1464,8 +3041,16 @@ def SDG(explanation=False):
     print(' The great composer Johan Sebastian Bach used to end his compositions with this small remark SDG.')
     print(' And I like to do that too :).')    
    
+def startup_info():
+   """ Print time of each startup step and of the imports made when first needed."""
+   print('Startup')
+   for step in startupTiming.keys():
+      print(' -' + step.ljust(18), format(1000*startupTiming[step], '8.1f'), 'ms')
+   
 #------------------------------------------------------------------------------------------------------------------
 #  Startup
 #------------------------------------------------------------------------------------------------------------------
 
+startupTiming['total'] = time.perf_counter() - startupTic
+
 BPL_info()
\ No newline at end of file
@@ -0,0 +1,286 @@
+# Local simulation service of FMU-explore for BPL_IEC_operation
+#          with a job queue, warm FMU workers and a persistent job log
+#------------------------------------------------------------------------------------------------------------------
+# 2026-10-17 - Created on top of BPL_IEC_fmpy_explore.py
+#------------------------------------------------------------------------------------------------------------------
+#
+# Usage:
+#   python BPL_IEC_fmpy_service.py --port 8000 --workers 4 --log jobs.jsonl
+#
+# Requests, all JSON:
+#   POST /jobs           - submit a job and get {"id": ...}, or status 503 with Retry-After when the queue is full
+#   GET  /jobs/<id>      - status of the job and the result when done, add ?wait=<s> to wait for the result
+#   GET  /status         - queue length, workers and number of jobs in each status
+#
+# A job is given as
+#   {"scenario": {"LFR": 60, ...},        - parValue updates relative the parValue of the explore-script
+#    "time": 600,                          - simulation time, default simulationTime of the explore-script
+#    "output": "kpi",                      - "kpi" or "trajectories"
+#    "variables": ["tank_harvest.V", ...], - variables for "trajectories", default storeSignals, time always given
+#    "ncp": 500,                           - number of output points, default from opts_std
+#    "priority": 0}                        - lower value is run first, in order of submission for the same value
+#
+# The service listen to localhost only and is meant to be shared by engineers on the same compute box.
+# Each worker is a thread that keeps its own FMU instance from fmuPool warm between jobs. The job log is a
+# JSONL-file with one record for each change of status, and at start jobs not done are queued again.
+# KPIs are kept in the log while trajectories are kept in memory only.
+#
+# Try locally with e.g.
+#   curl -X POST -d '{"scenario": {"LFR": 60}, "priority": 1}' localhost:8000/jobs
+#   curl localhost:8000/jobs/1?wait=60
+
+import sys
+import os
+import io
+import json
+import math
+import time
+import types
+import queue
+import argparse
+import threading
+import contextlib
+import datetime
+import urllib.parse
+
+from http.server import ThreadingHTTPServer
+from http.server import BaseHTTPRequestHandler
+
+#------------------------------------------------------------------------------------------------------------------
+#  Load explore-script as a module, headless
+#------------------------------------------------------------------------------------------------------------------
+
+def load_explore(explore):
+   """ Execute the explore-script in a new module in headless mode and return it, with printout suppressed."""
+   os.environ['FMU_EXPLORE_HEADLESS'] = '1'
+   module = types.ModuleType('BPL_IEC_explore_service')
+   module.__file__ = os.path.abspath(explore)
+   sys.modules[module.__name__] = module
+   with open(explore) as f:
+      code = compile(f.read(), explore, 'exec')
+   with contextlib.redirect_stdout(io.StringIO()):
+      exec(code, module.__dict__)
+   return module
+
+#------------------------------------------------------------------------------------------------------------------
+#  JSON - NaN and infinite values of results are given as null, since they are not valid JSON
+#------------------------------------------------------------------------------------------------------------------
+
+def json_safe(value):
+   """ Return value with NaN and infinite floats in nested dicts and lists replaced by None."""
+   if isinstance(value, float): return value if math.isfinite(value) else None
+   if isinstance(value, dict): return {key: json_safe(item) for key, item in value.items()}
+   if isinstance(value, (list, tuple)): return [json_safe(item) for item in value]
+   return value
+
+def json_dumps(value):
+   """ Return value as strict JSON, see json_safe()."""
+   return json.dumps(json_safe(value), allow_nan=False)
+
+#------------------------------------------------------------------------------------------------------------------
+#  Job queue and job log
+#------------------------------------------------------------------------------------------------------------------
+
+class JobQueue:
+   """ Jobs in a PriorityQueue of limited size with status and results kept by job id and in the job log."""
+
+   def __init__(self, m, log_file, size=100):
+      self.m = m
+      self.log_file = log_file
+      self.size = size
+      self.queue = queue.PriorityQueue()
+      self.jobs = {}
+      self.lock = threading.Lock()
+      self.done = threading.Condition(self.lock)
+      self.next_id = 1
+      self.replay()
+
+   def log(self, record):
+      """ Append a record to the job log, with the lock held."""
+      record['at'] = datetime.datetime.now().isoformat(timespec='milliseconds')
+      with open(self.log_file, 'a') as f:
+         f.write(json_dumps(record) + '\n')
+
+   def replay(self):
+      """ Read the job log and queue again the jobs that were not done, also beyond the size of the queue."""
+      try:
+         with open(self.log_file) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+      except FileNotFoundError:
+         records = []
+      for record in records:
+         if record['status'] == 'queued':
+            self.jobs[record['id']] = {'id': record['id'], 'status': 'queued', 'job': record['job'],
+                                       'result': None, 'error': None}
+         elif record['id'] in self.jobs:
+            self.jobs[record['id']].update({key: record[key] for key in ['status', 'result', 'error']
+                                            if key in record})
+         self.next_id = max(self.next_id, record['id'] + 1)
+      for job_id, entry in sorted(self.jobs.items()):
+         if entry['status'] in ['queued', 'running']:
+            entry['status'] = 'queued'
+            self.queue.put((entry['job']['priority'], job_id))
+
+   def submit(self, job):
+      """ Queue a checked job and return its id, or None if the queue is full."""
+      with self.lock:
+         if self.queue.qsize() >= self.size: return None
+         job_id = self.next_id
+         self.next_id = job_id + 1
+         self.queue.put((job['priority'], job_id))
+         self.jobs[job_id] = {'id': job_id, 'status': 'queued', 'job': job, 'result': None, 'error': None}
+         self.log({'id': job_id, 'status': 'queued', 'job': job})
+      return job_id
+
+   def status(self, job_id, wait=0):
+      """ Return the entry of a job, waiting at most wait seconds for it to be done, or None if not known."""
+      deadline = time.monotonic() + wait
+      with self.lock:
+         while (job_id in self.jobs) and (self.jobs[job_id]['status'] in ['queued', 'running']):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            self.done.wait(remaining)
+         if job_id not in self.jobs: return None
+         return dict(self.jobs[job_id])
+
+   def summary(self):
+      """ Return number of jobs in each status."""
+      with self.lock:
+         count = {}
+         for entry in self.jobs.values(): count[entry['status']] = count.get(entry['status'], 0) + 1
+         return count
+
+   def worker(self):
+      """ Run jobs from the queue, for ever, with an FMU instance from fmuPool kept warm between jobs."""
+      fmu_cache = self.m.fmu_pool_acquire()
+      self.m.fmu_instance_get(self.m.fmu_model, fmu_cache)
+      while True:
+         priority, job_id = self.queue.get()
+         with self.lock:
+            entry = self.jobs[job_id]
+            entry['status'] = 'running'
+            self.log({'id': job_id, 'status': 'running'})
+         try:
+            result, error = run_job(self.m, entry['job'], fmu_cache)
+         except Exception as exception:
+            result, error = None, repr(exception)
+         with self.lock:
+            entry.update({'status': 'failed' if error is not None else 'done', 'result': result, 'error': error})
+            record = {'id': job_id, 'status': entry['status'], 'error': error}
+            if entry['job']['output'] == 'kpi': record['result'] = result
+            self.log(record)
+            self.done.notify_all()
+
+#------------------------------------------------------------------------------------------------------------------
+#  Jobs
+#------------------------------------------------------------------------------------------------------------------
+
+def job_check(m, request):
+   """ Return the job with defaults filled in from a request, or raise ValueError."""
+   if not isinstance(request, dict): raise ValueError('job should be a JSON object')
+   unknown = [key for key in request.keys() if key not in ['scenario', 'time', 'output', 'variables', 'ncp', 'priority']]
+   if not unknown == []: raise ValueError('keys not known: ' + ', '.join(unknown))
+   job = {'scenario': request.get('scenario', {}),
+          'time': float(request.get('time', m.simulationTime)),
+          'output': request.get('output', 'kpi'),
+          'variables': request.get('variables', [name for name in m.storeSignals if not name == 'time']),
+          'ncp': int(request.get('ncp', m.opts_std['NCP'])),
+          'priority': int(request.get('priority', 0))}
+   if not isinstance(job['scenario'], dict): raise ValueError('scenario should be a JSON object')
+   unknown = [key for key in job['scenario'].keys() if key not in m.parValue.keys()]
+   if not unknown == []: raise ValueError(', '.join(unknown) + ' - seems not an accessible parameter')
+   if job['output'] not in ['kpi', 'trajectories']: raise ValueError('output should be kpi or trajectories')
+   if not (isinstance(job['variables'], list) and all(isinstance(name, str) for name in job['variables'])):
+      raise ValueError('variables should be a list of names')
+   if job['output'] == 'trajectories':
+      job['variables'] = [name for name in job['variables'] if not name == 'time']
+      unknown = [name for name in job['variables'] if name not in m.modelIndex]
+      if not unknown == []: raise ValueError(', '.join(unknown) + ' - seems not a variable of the model')
+   if (job['time'] <= 0) | (job['ncp'] < 1): raise ValueError('time and ncp should be positive')
+   return job
+
+def run_job(m, job, fmu_cache):
+   """ Simulate a job with the FMU instance in fmu_cache and return (result, error)."""
+   options = m.opts_std.copy()
+   options['NCP'] = job['ncp']
+   if job['output'] == 'kpi':
+      output = list(set(m.kpiVariables + list(m.stateValue.keys())))
+   else:
+      output = list(set(job['variables'] + ['time'] + list(m.stateValue.keys())))
+   result = m.sweep_scenario(job['scenario'], job['time'], options, output, fmu_cache=fmu_cache)
+   if result['error'] is not None: return None, result['error']
+   if job['output'] == 'kpi':
+      table = m.kpi(result['sim_res'])
+      return {name: float(table[name][0]) for name in table.dtype.names}, None
+   return {name: result['sim_res'][name].tolist() for name in ['time'] + job['variables']}, None
+
+#------------------------------------------------------------------------------------------------------------------
+#  HTTP
+#------------------------------------------------------------------------------------------------------------------
+
+class Handler(BaseHTTPRequestHandler):
+   """ Requests to the service, see the top of the file."""
+   jobs = None
+
+   def reply(self, code, body, headers=None):
+      if headers is None: headers = {}
+      data = json_dumps(body).encode()
+      self.send_response(code)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(data)))
+      for key, value in headers.items(): self.send_header(key, value)
+      self.end_headers()
+      self.wfile.write(data)
+
+   def do_POST(self):
+      if not self.path == '/jobs': return self.reply(404, {'error': 'not found'})
+      try:
+         request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+         job = job_check(self.jobs.m, request)
+      except (ValueError, TypeError) as error:
+         return self.reply(400, {'error': str(error)})
+      job_id = self.jobs.submit(job)
+      if job_id is None: return self.reply(503, {'error': 'queue full'}, {'Retry-After': '5'})
+      self.reply(202, {'id': job_id})
+
+   def do_GET(self):
+      url = urllib.parse.urlparse(self.path)
+      if url.path == '/status':
+         return self.reply(200, {'queue': self.jobs.queue.qsize(), 'queue_size': self.jobs.size,
+                                 'workers': self.server.workers, 'jobs': self.jobs.summary()})
+      parts = url.path.strip('/').split('/')
+      if (len(parts) == 2) and (parts[0] == 'jobs') and parts[1].isdigit():
+         try:
+            wait = float(urllib.parse.parse_qs(url.query).get('wait', ['0'])[0])
+         except ValueError:
+            return self.reply(400, {'error': 'wait should be a number'})
+         entry = self.jobs.status(int(parts[1]), min(wait, 300))
+         if entry is None: return self.reply(404, {'error': 'job not known'})
+         return self.reply(200, entry)
+      self.reply(404, {'error': 'not found'})
+
+#------------------------------------------------------------------------------------------------------------------
+#  Main
+#------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Local simulation service of FMU-explore for BPL_IEC_operation')
+   parser.add_argument('--explore', default='BPL_IEC_fmpy_explore.py', help='explore-script to use')
+   parser.add_argument('--port', type=int, default=8000, help='port on localhost')
+   parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of warm FMU workers')
+   parser.add_argument('--queue', type=int, default=100, help='jobs queued before requests get status 503')
+   parser.add_argument('--log', default='BPL_IEC_service_jobs.jsonl', help='persistent job log')
+   args = parser.parse_args()
+
+   m = load_explore(args.explore)
+   Handler.jobs = JobQueue(m, args.log, args.queue)
+   for k in range(args.workers):
+      threading.Thread(target=Handler.jobs.worker, daemon=True).start()
+
+   server = ThreadingHTTPServer(('127.0.0.1', args.port), Handler)
+   server.workers = args.workers
+   print('Service of', m.fmu_model, 'on http://127.0.0.1:' + str(args.port), 'with', args.workers, 'workers')
+   try:
+      server.serve_forever()
+   except KeyboardInterrupt:
+      server.server_close()